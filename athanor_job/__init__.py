@@ -1,5 +1,12 @@
 INSTALLED_APPS = ["athanor_job"]
 
+DATABASE_ROUTERS = ["athanor.jobs.routers.JobReadRouter"]
+
+# DATABASES alias for read-only job listings, or None to read everything from the primary.
+JOB_READ_DATABASE = None
+# Seconds an account's job reads stay on the primary after it writes.
+JOB_READ_STICKY = 10
+
 GLOBAL_SCRIPTS = dict()
 
 GLOBAL_SCRIPTS['job'] = {
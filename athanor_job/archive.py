@@ -0,0 +1,104 @@
+"""
+Cold-storage tier for long-closed jobs.
+
+archive_jobs() moves closed jobs, with their links and comments, into JobArchiveDB. Each job becomes
+one row, and its thread becomes a compressed JSON transcript. Search terms move with the job, so
+archived jobs stay searchable, and +job <id> reads them back through transcript().
+"""
+import json
+import zlib
+import datetime
+from django.db import transaction
+from django.db.models import F
+from evennia.utils.ansi import ANSIString
+from evennia.utils.utils import time_format
+from athanor.jobs.models import JobDB, JobLinkDB, JobCommentDB, JobArchiveDB, JobSearchTerm
+from athanor.jobs.projections import STATUS_LETTERS
+from athanor.jobs.retention import delete_jobs
+from athanor.utils.time import utcnow
+
+
+def encode(links, comments):
+    return zlib.compress(json.dumps({'links': links, 'comments': comments}, default=str).encode('utf-8'))
+
+
+def transcript(archive):
+    """
+    Returns:
+        (links, comments) as lists of dicts, comments in posting order. Dates are ISO strings.
+    """
+    data = json.loads(zlib.decompress(bytes(archive.db_transcript)).decode('utf-8'))
+    return data['links'], data['comments']
+
+
+def archive_jobs(older_than, buckets=None, limit=200):
+    """
+    Archives up to limit jobs closed before older_than, in one transaction.
+
+    Args:
+        older_than (datetime): Close date cutoff.
+        buckets (iterable): Only archive jobs in these Buckets, if given.
+        limit (int): Batch size.
+
+    Returns:
+        list of (job id, bucket id, status) for the archived jobs.
+    """
+    jobs = JobDB.objects.exclude(db_status=0).filter(db_date_closed__lt=older_than)
+    if buckets is not None:
+        jobs = jobs.filter(db_bucket__in=buckets)
+    now = utcnow()
+    with transaction.atomic():
+        jobs = list(jobs.select_related('db_bucket').order_by('id')[:limit])
+        if not jobs:
+            return list()
+        job_ids = [job.id for job in jobs]
+        links, owners = dict(), dict()
+        for row in JobLinkDB.objects.filter(db_job_id__in=job_ids).order_by('id')\
+                .values('id', 'db_job', 'db_account', 'db_account__db_key', 'db_link_type', 'db_date_checked'):
+            job_id = row.pop('db_job')
+            links.setdefault(job_id, list()).append({'id': row['id'], 'account': row['db_account'],
+                                                     'name': row['db_account__db_key'],
+                                                     'link_type': row['db_link_type'],
+                                                     'checked': row['db_date_checked']})
+            if row['db_link_type'] == 3 and job_id not in owners:
+                owners[job_id] = row['db_account']
+        comments = dict()
+        for row in JobCommentDB.objects.filter(db_link__db_job_id__in=job_ids).order_by('db_date_created', 'id')\
+                .values('db_link', 'db_link__db_job', 'db_link__db_account__db_key', 'db_link__db_link_type',
+                        'db_date_created', 'db_text', 'db_is_private', 'db_comment_mode'):
+            comments.setdefault(row['db_link__db_job'], list()).append({
+                'link': row['db_link'], 'poster': row['db_link__db_account__db_key'],
+                'link_type': row['db_link__db_link_type'], 'date': row['db_date_created'], 'text': row['db_text'],
+                'private': row['db_is_private'], 'mode': row['db_comment_mode']})
+        JobArchiveDB.objects.bulk_create([JobArchiveDB(
+            id=job.id, db_bucket=job.db_bucket, db_bucket_name=job.db_bucket.db_key, db_title=job.db_key[:255],
+            db_status=job.db_status, db_owner_id=owners.get(job.id), db_owner_name=job.db_owner_name,
+            db_handler_names=job.db_handler_names, db_helper_names=job.db_helper_names,
+            db_comment_count=len(comments.get(job.id, ())), db_date_created=job.db_date_created,
+            db_date_due=job.db_date_due, db_date_closed=job.db_date_closed, db_date_archived=now,
+            db_transcript=encode(links.get(job.id, list()), comments.get(job.id, list()))) for job in jobs])
+        JobSearchTerm.objects.filter(db_job_id__in=job_ids).update(db_archive_id=F('db_job_id'), db_job=None)
+        delete_jobs(job_ids)
+    return [(job.id, job.db_bucket_id, job.db_status) for job in jobs]
+
+
+def status_letter(archive):
+    return STATUS_LETTERS.get(archive.db_status, '?')
+
+
+def render_line(archive):
+    """
+    A listing row for an archived job, in the same columns as projections.format_job_line.
+    """
+    num = str(archive.id).rjust(4).ljust(5)
+    owner = archive.db_owner_name[:15].ljust(16)
+    title = archive.db_title[:29].ljust(30)
+    claimed = archive.db_handler_names[:12].ljust(13)
+    due = ANSIString("|xARCH|n").rjust(6).ljust(7)
+    closed = archive.db_date_closed or archive.db_date_archived
+    last = time_format((utcnow() - closed).total_seconds(), 1).rjust(4)
+    return f" {status_letter(archive)} {num}{owner}{title}{claimed}{due}{last}"
+
+
+def parse_date(text):
+    return datetime.datetime.fromisoformat(text) if text else None
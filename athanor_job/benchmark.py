@@ -0,0 +1,208 @@
+"""
+Synthetic-load benchmarks for the job system.
+
+Point a game's settings at a scratch SQLite or PostgreSQL database, then from `evennia shell`:
+
+    from athanor.jobs import benchmark
+    benchmark.run('small', output='bench.json')
+
+generate() fills the database with buckets, jobs, links, comments and accounts at the chosen scale.
+run() times the listing and posting paths and writes latency percentiles and query counts per
+operation as JSON, so runs can be compared across changes with compare().
+"""
+import json
+import random
+import datetime
+from django.conf import settings
+from django.db import connection, transaction
+from evennia.accounts.models import AccountDB
+from evennia.objects.models import ObjectDB
+from athanor.jobs.models import BucketDB, JobDB, JobLinkDB, JobCommentDB
+from athanor.jobs.profiling import QueryMeter, percentile, command
+from athanor.jobs.transfer import create_dated, reset_sequences
+from athanor.utils.time import utcnow
+
+SCALES = {
+    'small': {'buckets': 10, 'jobs': 5000, 'comments': 50000, 'accounts': 100},
+    'medium': {'buckets': 40, 'jobs': 50000, 'comments': 500000, 'accounts': 1000},
+    'large': {'buckets': 100, 'jobs': 500000, 'comments': 5000000, 'accounts': 5000},
+}
+
+_WORDS = ('request', 'approval', 'character', 'sheet', 'build', 'room', 'plot', 'scene', 'theme', 'staff',
+          'please', 'review', 'update', 'background', 'bug', 'typo', 'code', 'item', 'power', 'faction')
+
+
+def _text(rand, words):
+    return ' '.join(rand.choice(_WORDS) for _ in range(words))
+
+
+def _next_id(model):
+    last = model.objects.order_by('-id').values_list('id', flat=True).first()
+    return (last or 0) + 1
+
+
+def _insert(model, rows, batch_size):
+    with transaction.atomic():
+        model.objects.bulk_create(rows, batch_size=batch_size)
+
+
+def _insert_jobs(jobs, links, comments, batch_size):
+    # Jobs point at their owner link and last comments, so all three go in one transaction.
+    with transaction.atomic():
+        create_dated(JobDB, jobs, batch_size)
+        JobLinkDB.objects.bulk_create(links, batch_size=batch_size)
+        create_dated(JobCommentDB, comments, batch_size)
+
+
+def generate(scale='small', seed=0, batch_size=5000):
+    """
+    Fills the database with synthetic job data. Ids are assigned up front so the generated rows
+    can reference each other without reading them back.
+
+    Returns:
+        dict with the generated bucket ids and account ids.
+    """
+    sizes = SCALES[scale] if isinstance(scale, str) else scale
+    rand = random.Random(seed)
+    now = utcnow()
+
+    account_start = _next_id(AccountDB)
+    account_ids = list(range(account_start, account_start + sizes['accounts']))
+    _insert(AccountDB, [AccountDB(id=i, username=f"bench{i}", db_key=f"bench{i}") for i in account_ids], batch_size)
+    object_start = _next_id(ObjectDB)
+    character_ids = list(range(object_start, object_start + sizes['accounts']))
+    _insert(ObjectDB, [ObjectDB(id=i, db_key=f"BenchChar{i}") for i in character_ids], batch_size)
+
+    bucket_start = _next_id(BucketDB)
+    bucket_ids = list(range(bucket_start, bucket_start + sizes['buckets']))
+    _insert(BucketDB, [BucketDB(id=i, db_key=f"bench{i}", db_due=datetime.timedelta(days=7),
+                                db_lock_storage='see:all();post:all();admin:perm(Admin)')
+                       for i in bucket_ids], batch_size)
+
+    job_id = _next_id(JobDB)
+    link_id = _next_id(JobLinkDB)
+    comment_id = _next_id(JobCommentDB)
+    per_job = max(sizes['comments'] // max(sizes['jobs'], 1), 1)
+    jobs, links, comments = list(), list(), list()
+    for n in range(sizes['jobs']):
+        created = now - datetime.timedelta(seconds=rand.randint(0, 86400 * 365 * 3))
+        status = 0 if rand.random() < 0.1 else rand.randint(1, 3)
+        owner = rand.randrange(sizes['accounts'])
+        poster = f"bench{account_ids[owner]}"
+        job = JobDB(id=job_id, db_key=_text(rand, 4), db_bucket_id=rand.choice(bucket_ids), db_status=status,
+                    db_date_created=created, db_date_due=created + datetime.timedelta(days=7),
+                    db_date_closed=None if status == 0 else created + datetime.timedelta(days=3),
+                    db_owner_id=link_id, db_owner_name=poster, db_comment_count=per_job)
+        links.append(JobLinkDB(id=link_id, db_job_id=job_id, db_account_id=account_ids[owner],
+                               db_character_id=character_ids[owner], db_link_type=3, db_date_checked=created))
+        for c in range(per_job):
+            posted = created + datetime.timedelta(minutes=10 * c)
+            private = c > 0 and rand.random() < 0.2
+            comments.append(JobCommentDB(id=comment_id, db_link_id=link_id, db_text=_text(rand, 40),
+                                         db_comment_mode=0 if c == 0 else 1, db_is_private=private,
+                                         db_date_created=posted))
+            job.db_last_admin_id, job.db_last_admin_poster, job.db_date_admin_update = comment_id, poster, posted
+            if not private:
+                job.db_last_public_id, job.db_last_public_poster = comment_id, poster
+                job.db_date_public_update = posted
+            comment_id += 1
+        jobs.append(job)
+        job_id += 1
+        link_id += 1
+        if len(comments) >= batch_size:
+            _insert_jobs(jobs, links, comments, batch_size)
+            jobs, links, comments = list(), list(), list()
+    _insert_jobs(jobs, links, comments, batch_size)
+    reset_sequences([AccountDB, ObjectDB, BucketDB, JobDB, JobLinkDB, JobCommentDB])
+    return {'buckets': bucket_ids, 'accounts': account_ids}
+
+
+def measure(func, iterations=20):
+    """
+    Runs func repeatedly and summarizes its latency and query counts.
+    """
+    samples = list()
+    for _ in range(iterations):
+        with QueryMeter() as meter:
+            func()
+        samples.append(meter)
+    wall = [s.wall_time * 1000 for s in samples]
+    db = [s.db_time * 1000 for s in samples]
+    queries = [s.queries for s in samples]
+    return {
+        'iterations': iterations,
+        'p50_ms': percentile(wall, 50), 'p90_ms': percentile(wall, 90), 'p99_ms': percentile(wall, 99),
+        'max_ms': max(wall), 'db_p50_ms': percentile(db, 50),
+        'queries_min': min(queries), 'queries_max': max(queries),
+    }
+
+
+def operations(account, bucket, job):
+    import evennia
+    from athanor.jobs.commands import CmdJobList, CmdJBucket, CmdJob
+    jobs = evennia.GLOBAL_SCRIPTS.jobs
+    return {
+        'display_buckets': lambda: command(CmdJBucket, account).display_buckets(),
+        'display_bucket': lambda: command(CmdJobList, account, bucket.key).display_bucket(bucket.key),
+        'display_bucket_old': lambda: command(CmdJobList, account, bucket.key).display_bucket(bucket.key, old=True),
+        'display_job': lambda: command(CmdJob, account, str(job.id)).display_job(str(job.id)),
+        'switch_scan': lambda: command(CmdJobList, account, switches=['scan']).switch_scan(),
+        'switch_pending': lambda: command(CmdJobList, account, switches=['pending']).switch_pending(),
+        'create_job': lambda: jobs.create_job(account, bucket, 'Benchmark request', 'Benchmark opening text.'),
+        'create_comment': lambda: jobs.create_comment(account, job, 'Benchmark reply.', comment_type=1),
+    }
+
+
+def run(scale='small', iterations=20, output=None, populate=True, account=None, seed=0):
+    """
+    Benchmarks every operation and optionally saves the results as JSON.
+
+    Args:
+        scale (str or dict): A SCALES key or explicit sizes, used if populate is True.
+        iterations (int): Timed runs per operation.
+        output (str): Path to write the JSON results to.
+        populate (bool): Generate data first. Use False to re-run against an existing data set.
+        account (AccountDB): The viewer. Defaults to the first superuser.
+
+    Returns:
+        dict of results.
+    """
+    if populate:
+        generate(scale, seed=seed)
+    if account is None:
+        account = AccountDB.objects.filter(is_superuser=True).order_by('id').first()
+    bucket = BucketDB.objects.order_by('-id').first()
+    job = JobDB.objects.filter(db_bucket=bucket).order_by('-db_comment_count', 'id').first()
+    results = {
+        'scale': scale,
+        'vendor': connection.vendor,
+        'database': settings.DATABASES['default'].get('NAME'),
+        'timestamp': utcnow().isoformat(),
+        'operations': dict(),
+    }
+    for name, func in operations(account, bucket, job).items():
+        results['operations'][name] = measure(func, iterations)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2, default=str)
+    return results
+
+
+def compare(before, after):
+    """
+    Compares two saved result files.
+
+    Returns:
+        dict of operation: {'p50_change': ratio, 'queries_change': difference}
+    """
+    with open(before) as f:
+        old = json.load(f)['operations']
+    with open(after) as f:
+        new = json.load(f)['operations']
+    report = dict()
+    for name in sorted(set(old) & set(new)):
+        report[name] = {
+            'p50_change': new[name]['p50_ms'] / old[name]['p50_ms'] if old[name]['p50_ms'] else None,
+            'queries_change': new[name]['queries_max'] - old[name]['queries_max'],
+        }
+    return report
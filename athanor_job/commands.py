@@ -1,101 +1,239 @@
-import math, datetime
+from copy import copy
+from collections import defaultdict
+from functools import wraps
+from twisted.internet import threads
+from twisted.internet.defer import DeferredSemaphore
 from django.conf import settings
+from django.db import close_old_connections
 import evennia
+from evennia.utils import logger
 from evennia.utils.utils import time_format, class_from_module
+from evennia.utils.validatorfuncs import duration
+from athanor.jobs.profiling import QueryMeter, record
+from athanor.jobs import archive, routers
+from athanor.jobs.gamedb import render_job_lines
+from athanor.jobs.models import BucketDB, JobDB
+from athanor.jobs.projections import format_comment
 
 COMMAND_DEFAULT_CLASS = class_from_module(settings.COMMAND_DEFAULT_CLASS)
 
 JOB_COLUMNS = f"*    ID Submitter       Title                         Claimed         Due  Lst"
 
+# Shared by every job command running off the reactor. Rebuilt whenever the async_limit option changes.
+_LIMITER = None
+# (account id, command key, switch) for every off-reactor command still running.
+_IN_FLIGHT = set()
+
+
+def limiter():
+    global _LIMITER
+    limit = evennia.GLOBAL_SCRIPTS.jobs.options.async_limit
+    if _LIMITER is None or _LIMITER.limit != limit:
+        _LIMITER = DeferredSemaphore(limit)
+    return _LIMITER
+
+
+def replica_read(func):
+    """
+    Lets a read-only JobCmd view read job tables from the JOB_READ_DATABASE replica.
+    """
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with routers.reading(self.account):
+            return func(self, *args, **kwargs)
+    return wrapper
+
 
 class JobCmd(COMMAND_DEFAULT_CLASS):
     account_caller = True
     system_name = "JOBS"
     help_category = "Job System / Issue Tracker"
-
-    def display_job(self, lhs):
+    comments_per_page = 20
+    # Maximum queries per switch ('main' for no switch). Exceeding one logs a warning in DEBUG mode.
+    query_budgets = {'main': 15}
+    query_stats = None
+    # Read-only switches that may run on a worker thread when the async_commands option is on. Anything
+    # they change in the JobManager's memory must go through JobManager.on_reactor().
+    async_switches = ()
+
+    def func(self):
+        if self.query_switch() in self.async_switches and evennia.GLOBAL_SCRIPTS.jobs.options.async_commands:
+            self.func_async()
+        else:
+            self.run_metered()
+
+    def func_async(self):
+        """
+        Runs the command on a worker thread, limited by the async_limit option, and delivers its
+        output from the reactor when it's done. An account gets one of each such command in flight.
+        """
+        key = (self.account.id, self.key, self.query_switch())
+        if key in _IN_FLIGHT:
+            self.msg("Still working on your last request. Please wait.")
+            return
+        _IN_FLIGHT.add(key)
+        worker = copy(self)
+        output = list()
+        worker.msg = lambda text=None, **kwargs: output.append((text, kwargs))
+
+        def run():
+            try:
+                worker.run_metered()
+            except ValueError as err:
+                output.append((str(err), dict()))
+            finally:
+                close_old_connections()
+
+        def deliver(result):
+            for text, kwargs in output:
+                self.msg(text, **kwargs)
+
+        def failed(failure):
+            logger.log_err(f"{self.key} for {self.account} failed: {failure.getTraceback()}")
+            self.msg("Sorry, something went wrong with that request.")
+
+        d = limiter().run(threads.deferToThread, run)
+        d.addCallbacks(deliver, failed)
+        d.addBoth(lambda result: _IN_FLIGHT.discard(key))
+
+    def run_metered(self):
+        meter = QueryMeter()
+        try:
+            with meter, routers.acting(self.account):
+                super().func()
+        finally:
+            self.query_stats = meter
+            record(f"{self.key}/{self.query_switch()}", meter.wall_time)
+            self.check_query_budget()
+
+    def query_switch(self):
+        return self.switches[0] if self.switches else 'main'
+
+    def query_budget(self):
+        return self.query_budgets.get(self.query_switch())
+
+    def check_query_budget(self):
+        budget = self.query_budget()
+        if budget is None or not settings.DEBUG or self.query_stats.queries <= budget:
+            return
+        stats = self.query_stats
+        logger.log_warn(f"{self.key}/{self.query_switch()} by {self.account} ran {stats.queries} queries "
+                        f"(budget {budget}) in {stats.wall_time * 1000:.1f}ms, {stats.db_time * 1000:.1f}ms in DB.")
+
+    @replica_read
+    def display_job(self, lhs, last=None):
+        page = None
+        if '/' in lhs:
+            lhs, page = lhs.split('/', 1)
+            page = int(page) if page.isdigit() else None
         admin = False
-        job = evennia.GLOBAL_SCRIPTS.jobs.find_job(self.account, self.lhs)
-        if job.bucket.access(self.account, 'admin') or job.links.filter(link_type=2, account_stub=self.account.stub):
+        try:
+            job = evennia.GLOBAL_SCRIPTS.jobs.find_job(self.account, lhs)
+        except ValueError:
+            archived = evennia.GLOBAL_SCRIPTS.jobs.find_archived(self.account, lhs)
+            if not archived:
+                raise
+            self.display_archive(archived, page=page, last=last)
+            return
+        if evennia.GLOBAL_SCRIPTS.jobs.bucket_access(self.account, job.bucket, 'admin') or job.links.filter(db_link_type=2, db_account=self.account).exists():
             admin = True
-        message = list()
-        message.append(self.styled_header(f'{job.bucket} Job {job.id} - {job.status_word()}'))
-        message.append(f"|hTitle:|n {job.title}")
-        message.append(f'|hHandlers:|n {job.handler_names()}')
-        message.append(f'|hHelpers:|n {job.helper_names()}')
-        comments = job.comments()
+        comments, page, pages = job.comment_page(admin, page=page, last=last, per_page=self.comments_per_page)
+        self.msg('\n'.join(str(l) for l in self.render_job(job, admin, comments, page, pages)))
+        job.update_read(self.account)
+
+    def display_archive(self, archived, page=None, last=None):
+        admin = bool(archived.db_bucket) and evennia.GLOBAL_SCRIPTS.jobs.bucket_access(self.account,
+                                                                                       archived.db_bucket, 'admin')
+        links, comments = archive.transcript(archived)
         if not admin:
-            comments = comments.exclude(is_private=True)
-        for com in comments:
+            comments = [com for com in comments if not com['private']]
+        per_page = self.comments_per_page
+        pages = max((len(comments) + per_page - 1) // per_page, 1)
+        if last:
+            show, page = comments[-last:], pages
+        else:
+            page = pages if page is None else min(max(page, 1), pages)
+            show = comments[(page - 1) * per_page:page * per_page]
+        message = list()
+        message.append(self.styled_header(f"{archived.db_bucket_name} Job {archived.id} - Archived"))
+        message.append(f"|hTitle:|n {archived.db_title}")
+        message.append(f"|hHandlers:|n {archived.db_handler_names}")
+        message.append(f"|hHelpers:|n {archived.db_helper_names}")
+        for com in show:
             message.append(self.styled_separator())
-            message.append(com.display(self.account, admin))
-        message.append(self.styled_footer(f"Due: {self.account.display_time(job.due_date)}"))
-        job.update_read(self.account)
-        self.msg('\n'.join(message))
+            message.append(format_comment(com['poster'], com['mode'], archive.parse_date(com['date']), com['text'],
+                                          self.account))
+        message.append(self.styled_footer(f"Archived: {self.account.display_time(archived.db_date_archived)} "
+                                          f"< Page {page} of {pages} >"))
+        self.msg('\n'.join(str(l) for l in message))
+
+    def render_job(self, job, admin, comments, page, pages):
+        yield self.styled_header(f'{job.bucket} Job {job.id} - {job.status_word()}')
+        yield f"|hTitle:|n {job.title}"
+        yield f'|hHandlers:|n {job.handler_names()}'
+        yield f'|hHelpers:|n {job.helper_names()}'
+        for com in comments:
+            yield self.styled_separator()
+            yield com.display(self.account, admin)
+        yield self.styled_footer(f"Due: {self.account.display_time(job.due_date)} < Page {page} of {pages} >")
 
+    @replica_read
     def display_buckets(self):
         message = list()
         message.append(self.styled_header('Job Buckets'))
         col_color = self.account.options.column_names_color
         message.append(f"|{col_color}Name     Description                        Pen  App  Dny  Cnc  Over Due  Anon|n")
         message.append(self.styled_separator())
-        for bucket in evennia.GLOBAL_SCRIPTS.jobs.visible_buckets(self.account):
+        for bucket, counts in evennia.GLOBAL_SCRIPTS.jobs.bucket_summary(self.account):
             bkey = bucket.key[:8].ljust(8)
             description = bucket.description
             if not description:
                 description = ""
-            pending = str(bucket.jobs.filter(status=0).count()).rjust(3).ljust(4)
-            approved = str(bucket.jobs.filter(status=1).count()).rjust(3).ljust(4)
-            denied = str(bucket.jobs.filter(status=2).count()).rjust(3).ljust(4)
-            canceled = str(bucket.jobs.filter(status=3).count()).rjust(3).ljust(4)
+            pending, approved, denied, canceled, overdue = [str(counts[k]).rjust(3).ljust(4) for k in
+                                                            ('pending', 'approved', 'denied', 'canceled', 'overdue')]
             anon = 'No'
-            now = datetime.datetime.utcnow()
-            overdue = str(bucket.jobs.filter(status=0, due_date__lt=now).count()).rjust(3).ljust(4)
             due = time_format(bucket.due.total_seconds(), style=1).rjust(3)
             message.append(f"{bkey} {description[:34].ljust(34)} {pending} {approved} {denied} {canceled} {overdue} {due}  {anon}")
         message.append(self.styled_footer())
         self.msg('\n'.join(str(l) for l in message))
 
-    def display_bucket(self, bucket, old=False):
-        page = 1
-        if '/' in bucket:
-            bucket, page = bucket.split('/', 1)
-            if page.isdigit():
-                page = int(page)
-            else:
-                page = 1
+    @replica_read
+    def display_bucket(self, bucket, old=False, before=None):
+        """
+        One screen of a Bucket's listing, newest first. before is the cursor: the id that the
+        previous screen ended on. Every screen costs the same however far back it is.
+        """
         bucket = evennia.GLOBAL_SCRIPTS.jobs.find_bucket(self.account, bucket)
-        admin = bucket.access(self.account, "admin")
+        admin = evennia.GLOBAL_SCRIPTS.jobs.bucket_access(self.account, bucket, "admin")
         if not admin:
             raise ValueError("Permission denied.")
-        if old:
-            jobs = bucket.old()
-        else:
-            jobs = bucket.active()
-        jobs_count = len(jobs)
-        if not jobs_count:
+        if before:
+            if not before.strip().isdigit():
+                raise ValueError("The listing cursor must be a job ID!")
+            before = int(before)
+        mode = 'old' if old else 'display'
+        jobs = bucket.seek(mode, before or None, 30)
+        if not jobs:
             raise ValueError("No jobs to display!")
-        pages = float(jobs_count) / 30.0
-        pages = int(math.ceil(pages))
-        if page > pages:
-            page = pages
-        if page < 1:
-            page = 1
+        total = evennia.GLOBAL_SCRIPTS.jobs.count_listing(bucket, mode)
         message = list()
         message.append(self.styled_header(f"{'Old' if old else 'Active'} Jobs - {bucket}"))
         message.append(JOB_COLUMNS)
         message.append(self.styled_separator())
-        for job in jobs:
-            message.append(job.display_line(self.account, admin))
-        message.append(self.styled_footer(f'< Page {page} of {pages} >'))
+        message.extend(render_job_lines(jobs, self.account, admin))
+        footer = f"{total} Total" if total is not None else ''
+        if len(jobs) == 30:
+            more = f"Older: {self.key}{'/old' if old else ''} {bucket}={jobs[-1].id}"
+            footer = f"{footer} - {more}" if footer else more
+        message.append(self.styled_footer(f"< {footer} >") if footer else self.styled_footer())
         self.msg("\n".join(str(l) for l in message))
 
     def switch_main(self):
         if self.args:
-            if self.lhs.isdigit():
+            if self.lhs.split('/', 1)[0].isdigit():
                 self.display_job(self.lhs)
             else:
-                self.display_bucket(self.lhs)
+                self.display_bucket(self.lhs, before=self.rhs)
         else:
             self.display_buckets()
 
@@ -104,7 +242,10 @@ class CmdJBucket(JobCmd):
     key = '+jbucket'
     aliases = ['+jbuckets', ]
     locks = 'cmd:perm(Admin) or perm(Job_Admin)'
-    switch_options = ['create', 'delete', 'rename', 'lock', 'due', 'describe']
+    switch_options = ['create', 'delete', 'rename', 'lock', 'due', 'describe', 'reindex', 'archive', 'export',
+                      'import', 'legacy', 'retention']
+    async_switches = ('main', )
+    query_budgets = {'main': 10}
 
     def switch_create(self):
         evennia.GLOBAL_SCRIPTS.jobs.create_bucket(self.account, self.lhs, self.rhs)
@@ -124,6 +265,38 @@ class CmdJBucket(JobCmd):
     def switch_describe(self):
         evennia.GLOBAL_SCRIPTS.jobs.describe_bucket(self.account, self.lhs, self.rhs)
 
+    def switch_archive(self):
+        age = duration(self.args, option_key='Archive Age') if self.args else None
+        evennia.GLOBAL_SCRIPTS.jobs.archive_jobs(self.account, age=age)
+
+    def switch_export(self):
+        evennia.GLOBAL_SCRIPTS.jobs.export_jobs(self.account, self.args)
+
+    def switch_import(self):
+        evennia.GLOBAL_SCRIPTS.jobs.import_jobs(self.account, self.args)
+
+    def switch_legacy(self):
+        evennia.GLOBAL_SCRIPTS.jobs.import_legacy(self.account, self.args)
+
+    def switch_retention(self):
+        if self.args:
+            evennia.GLOBAL_SCRIPTS.jobs.set_retention(self.account, self.lhs, self.rhs)
+            return
+        rows = evennia.GLOBAL_SCRIPTS.jobs.retention_status(self.account)
+        message = list()
+        message.append(self.styled_header('Job Retention'))
+        col_color = self.account.options.column_names_color
+        message.append(f"|{col_color}Name     Action   Age         Done     Waiting|n")
+        message.append(self.styled_separator())
+        for name, action, age, done, waiting in rows:
+            age = time_format(age.total_seconds(), style=1) if age else ''
+            message.append(f"{name[:8].ljust(8)} {action.ljust(8)} {age[:11].ljust(11)} {str(done).ljust(8)} {waiting}")
+        message.append(self.styled_footer())
+        self.msg('\n'.join(str(l) for l in message))
+
+    def switch_reindex(self):
+        evennia.GLOBAL_SCRIPTS.jobs.rebuild_search(self.account)
+
     def switch_main(self):
         self.display_buckets()
 
@@ -131,7 +304,28 @@ class CmdJBucket(JobCmd):
 class CmdJobAdmin(JobCmd):
     key = "+jadmin"
     switch_options = ['addhandler', 'remhandler', 'addhelper', 'remhelper', 'move', 'due', 'approve', 'deny', 'cancel',
-                      'revive', 'claim', 'unclaim']
+                      'revive', 'claim', 'unclaim', 'stats']
+
+    def switch_stats(self):
+        if not evennia.GLOBAL_SCRIPTS.jobs.access(self.account, 'admin'):
+            raise ValueError("Permission denied!")
+        stats = evennia.GLOBAL_SCRIPTS.jobs.performance_stats()
+        col_color = self.account.options.column_names_color
+        message = list()
+        message.append(self.styled_header('Job System Performance'))
+        message.append(f"|{col_color}Operation                      Count    p50ms    p90ms    p99ms    maxms|n")
+        message.append(self.styled_separator())
+        for name, t in stats['timings'].items():
+            message.append(f"{name[:30].ljust(30)} {str(t['count']).rjust(6)} {t['p50_ms']:8.1f} {t['p90_ms']:8.1f} "
+                           f"{t['p99_ms']:8.1f} {t['max_ms']:8.1f}")
+        message.append(self.styled_separator('Caches'))
+        for name, cache in stats['caches'].items():
+            message.append(f"{name[:30].ljust(30)} " + ', '.join(f"{k}: {v:.2f}" if isinstance(v, float) else f"{k}: {v}"
+                                                                 for k, v in cache.items()))
+        message.append(self.styled_separator('Queues'))
+        message.append(', '.join(f"{k}: {v}" for k, v in stats['queues'].items()))
+        message.append(self.styled_footer())
+        self.msg('\n'.join(str(l) for l in message))
 
     def switch_claim(self):
         self.switch_addhandler()
@@ -172,16 +366,16 @@ class CmdJobAdmin(JobCmd):
                                                    rank=0, start_type=1)
 
     def switch_approve(self):
-        pass
+        evennia.GLOBAL_SCRIPTS.jobs.change_jobs_status(self.account, self.lhs, 1, text=self.rhs)
 
     def switch_deny(self):
-        pass
+        evennia.GLOBAL_SCRIPTS.jobs.change_jobs_status(self.account, self.lhs, 2, text=self.rhs)
 
     def switch_cancel(self):
-        pass
+        evennia.GLOBAL_SCRIPTS.jobs.change_jobs_status(self.account, self.lhs, 3, text=self.rhs)
 
     def switch_revive(self):
-        pass
+        evennia.GLOBAL_SCRIPTS.jobs.change_jobs_status(self.account, self.lhs, 0, text=self.rhs)
 
     def switch_due(self):
         pass
@@ -193,69 +387,92 @@ class CmdJobAdmin(JobCmd):
 class CmdJobList(JobCmd):
     key = "+jlist"
     switch_options = ['old', 'pending', 'brief', 'search', 'scan', 'next']
+    async_switches = ('main', 'old', 'pending', 'search', 'scan', 'next')
+    query_budgets = {'main': 15, 'old': 15, 'pending': 25, 'search': 15, 'scan': 15, 'next': 25}
 
     def switch_pending(self):
+        jobs = evennia.GLOBAL_SCRIPTS.jobs
         if self.lhs:
-            buckets = [bucket for bucket in [evennia.GLOBAL_SCRIPTS.jobs.find_bucket(self.account, self.lhs), ] if bucket.jobs.filter(status=0).count() and bucket.access(self.account, "admin")]
+            candidates = [jobs.find_bucket(self.account, self.lhs)]
         else:
-            buckets = [bucket for bucket in evennia.GLOBAL_SCRIPTS.jobs.visible_buckets(self.account)
-                       if bucket.jobs.filter(status=0).count() and bucket.access(self.account, "admin")]
+            candidates = jobs.visible_buckets(self.account)
+        buckets = list()
+        for bucket in candidates:
+            if not jobs.bucket_access(self.account, bucket, "admin"):
+                continue
+            total = jobs.count_listing(bucket, 'pending')
+            if total is None:
+                total = bucket.jobs.filter(db_status=0).count()
+            if total:
+                buckets.append((bucket, total))
         if not buckets:
             raise ValueError("No visible Pending jobs for applicable Job Buckets.")
         message = list()
         message.append(self.styled_header("Pending Jobs"))
         message.append(JOB_COLUMNS)
-        for bucket in buckets:
-            message.append(self.styled_separator(f"Pending for: {bucket} - {bucket.jobs.filter(status=0).count()} Total"))
-            for j in bucket.jobs.filter(status=0).reverse()[:20]:
-                message.append(j.display_line(self.account, admin=True))
+        for bucket, total in buckets:
+            message.append(self.styled_separator(f"Pending for: {bucket} - {total} Total"))
+            message.extend(render_job_lines(bucket.seek('pending', per_page=20), self.account, admin=True))
         message.append(self.styled_footer(()))
         self.msg('\n'.join(message))
 
     def switch_scan(self):
-        buckets = [bucket for bucket in evennia.GLOBAL_SCRIPTS.jobs.visible_buckets(self.account)
-                   if bucket.access(self.account, "admin")]
-        message = list()
-        all_buckets = list()
-        for bucket in buckets:
-            pen_jobs = bucket.new(self.account)
-            if pen_jobs:
-                all_buckets.append((bucket, pen_jobs))
-        if not all_buckets:
+        jobs = evennia.GLOBAL_SCRIPTS.jobs.unread_jobs(self.account)
+        if not jobs:
             raise ValueError("Nothing new to show!")
-        for bucket, jobs in all_buckets:
+        names = BucketDB.objects.in_bulk({job.db_bucket_id for job in jobs})
+        all_buckets = defaultdict(list)
+        for job in jobs:
+            all_buckets[names[job.db_bucket_id]].append(job)
+        message = list()
+        for bucket, jobs in all_buckets.items():
             message.append(self.styled_separator(f'Job Activity - {bucket}'))
-            for j in jobs:
-                message.append(j.display_line(self.account, admin=True))
+            message.extend(render_job_lines(jobs, self.account, admin=True))
         message.append(self.styled_footer())
         self.msg('\n'.join(message))
 
     def switch_next(self):
-        buckets = [bucket for bucket in evennia.GLOBAL_SCRIPTS.jobs.visible_buckets(self.account)
-                   if bucket.access(self.account, "admin")]
-        job = None
-        for bucket in buckets:
-            job = bucket.new(self.account).first()
-            if job:
-                break
-        if not job:
+        jobs = evennia.GLOBAL_SCRIPTS.jobs.unread_jobs(self.account)
+        if not jobs:
             raise ValueError("Nothing new to show!")
-        self.display_job(str(job.id))
+        self.display_job(str(jobs[0].id))
 
     def switch_old(self):
-        self.display_bucket(self.lhs, old=True)
+        self.display_bucket(self.lhs, old=True, before=self.rhs)
 
     def switch_brief(self):
         pass
 
     def switch_search(self):
-        pass
+        jobs = evennia.GLOBAL_SCRIPTS.jobs.search_jobs(self.account, self.args)
+        if not jobs:
+            raise ValueError("No matching jobs found.")
+        message = list()
+        message.append(self.styled_header(f"Job Search - {self.args}"))
+        message.append(JOB_COLUMNS)
+        message.append(self.styled_separator())
+        live = [job for job in jobs if isinstance(job, JobDB)]
+        admin_buckets = {bucket.id for bucket in {job.bucket for job in live}
+                         if evennia.GLOBAL_SCRIPTS.jobs.bucket_access(self.account, bucket, 'admin')}
+        lines = dict()
+        for admin in (True, False):
+            shown = [job for job in live if (job.db_bucket_id in admin_buckets) == admin]
+            lines.update(zip([job.id for job in shown], render_job_lines(shown, self.account, admin=admin)))
+        message.extend(lines[job.id] if isinstance(job, JobDB) else archive.render_line(job) for job in jobs)
+        message.append(self.styled_footer())
+        self.msg('\n'.join(str(l) for l in message))
 
 
 class CmdJob(JobCmd):
     key = '+job'
     aliases = ['+jobs', ]
-    switch_options = ['reply', 'comment']
+    switch_options = ['reply', 'comment', 'last']
+    async_switches = ('main', 'last')
+    query_budgets = {'main': 25, 'last': 25}
+
+    def switch_last(self):
+        count = int(self.rhs) if self.rhs and self.rhs.isdigit() else 10
+        self.display_job(self.lhs, last=count)
 
     def switch_reply(self):
         evennia.GLOBAL_SCRIPTS.jobs.create_comment(self.account, self.lhs, comment_text=self.rhs, comment_type=1)
@@ -1,16 +1,34 @@
 import re
+import time
+import heapq
+from twisted.internet import reactor, threads
+from twisted.python.threadable import isInIOThread
+from django.db import transaction, close_old_connections
+from django.db.models import Count, Q, F, Max, OuterRef, Subquery
+from django.db.models.query import QuerySet
 from evennia.locks.lockhandler import LockException
+from evennia.utils import logger
+from evennia.server.signals import SIGNAL_ACCOUNT_POST_LOGIN, SIGNAL_ACCOUNT_POST_LAST_LOGOUT
 from athanor.core.scripts import AthanorGlobalScript
-from athanor.jobs.models import BucketDB, JobDB
+from athanor.jobs.models import BucketDB, JobDB, JobLinkDB, JobCommentDB, JobArchiveDB
 from athanor.utils.text import partial_match
+from athanor.jobs import search, archive, transfer, legacy, routers, retention
+from athanor.jobs.profiling import timed, timing_summary
+from athanor.jobs.projections import JobRow, job_line_static
+from athanor.utils.time import utcnow
+from athanor.utils.online import accounts as online_accounts
+from evennia.utils.utils import time_format
 from evennia.utils.validatorfuncs import duration, unsigned_integer, lock
 
 
 _RE_BUCKET = re.compile(r"^[a-zA-Z]{3,8}$")
 
-_JOB_LINK_KIND = {0: 'Opened', 1: 'Replied', 2: '|rSTAFF COMMENTED|n', 3: 'Moved', 4: 'Approved',
-                5: 'Denied', 6: 'Canceled', 7: 'Revived', 8: 'Appointed Handler', 9: 'Appointed Helper',
-                10: 'Removed Handler', 11: 'Removed Helper', 12: 'Due Date Changed'}
+_JOB_STATUS_COUNTS = {0: 'pending', 1: 'approved', 2: 'denied', 3: 'canceled'}
+
+# New status: (comment mode, verb)
+_JOB_STATUS_CHANGE = {0: (7, 'revived'), 1: (4, 'approved'), 2: (5, 'denied'), 3: (6, 'canceled')}
+
+_RE_JOB_RANGE = re.compile(r"^(\d+)\s*-\s*(\d+)$")
 
 
 class JobManager(AthanorGlobalScript):
@@ -18,13 +36,692 @@ class JobManager(AthanorGlobalScript):
     option_dict = {
         'bucket_locks': ('Default locks to use for new Buckets', 'Lock', 'see:all();post:all();admin:perm(Admin) or perm(Job_Admin)'),
         'bucket_due': ('Default due duration for new Buckets.', 'Duration', 604800),
+        'count_cache': ('Keep per-Bucket job status counts in memory?', 'Boolean', True),
+        'access_cache': ('Cache Bucket lock checks in memory until the next tick?', 'Boolean', True),
+        'due_warning': ('How long before a pending job is due to warn its Bucket admins.', 'Duration', 86400),
+        'archive_age': ('How long a job must be closed before it can be archived.', 'Duration', 31536000),
+        'render_cache': ('Cache the unchanging parts of job listing rows?', 'Boolean', True),
+        'async_commands': ('Run heavy job listings on worker threads instead of the reactor?', 'Boolean', False),
+        'async_limit': ('Maximum job listings running on worker threads at once.', 'PositiveInteger', 4),
+        'retention_budget': ('Milliseconds of each tick retention and Bucket deletion may use.', 'PositiveInteger', 500),
+        'retention_batch': ('Jobs purged or archived per retention batch.', 'PositiveInteger', 100),
     }
 
+    def at_start(self):
+        super().at_start()
+        SIGNAL_ACCOUNT_POST_LOGIN.connect(self.at_account_login, dispatch_uid='athanor_job_login')
+        SIGNAL_ACCOUNT_POST_LAST_LOGOUT.connect(self.at_account_logout, dispatch_uid='athanor_job_logout')
+        self.load_due()
+
+    def at_stop(self):
+        super().at_stop()
+        if self.ndb.due_timer and self.ndb.due_timer.active():
+            self.ndb.due_timer.cancel()
+        self.flush_receipts()
+
+    def at_server_reload(self):
+        super().at_server_reload()
+        self.flush_receipts()
+
+    def at_server_shutdown(self):
+        super().at_server_shutdown()
+        self.flush_receipts()
+
+    def at_repeat(self):
+        super().at_repeat()
+        # Permission changes don't announce themselves, so cached lock decisions only live one tick.
+        self.clear_access()
+        self.flush_receipts()
+        self.retention_tick()
+
+    def on_reactor(self, func, *args, **kwargs):
+        """
+        Calls func now if this is the reactor thread, or queues it on the reactor from a worker thread.
+        Every change to this script's in-memory state goes through here, so commands running off the
+        reactor never race it.
+        """
+        if isInIOThread():
+            return func(*args, **kwargs)
+        reactor.callFromThread(func, *args, **kwargs)
+
+    def bucket_access(self, account, bucket, access_type):
+        """
+        Cached bucket.access(account, access_type).
+        """
+        if not self.options.access_cache:
+            return bucket.access(account, access_type)
+        if not isInIOThread():
+            found = (self.ndb.access or dict()).get((account.id, bucket.id, access_type))
+            if found is None:
+                found = bool(bucket.access(account, access_type))
+                reactor.callFromThread(self.bucket_access, account, bucket, access_type)
+            return found
+        if self.ndb.access is None:
+            self.ndb.access = dict()
+            self.ndb.access_hits = 0
+            self.ndb.access_misses = 0
+        key = (account.id, bucket.id, access_type)
+        found = self.ndb.access.get(key)
+        if found is None:
+            self.ndb.access_misses += 1
+            found = self.ndb.access[key] = bool(bucket.access(account, access_type))
+        else:
+            self.ndb.access_hits += 1
+        return found
+
+    def clear_access(self, account=None, bucket=None):
+        """
+        Forget cached lock decisions and what was built from them. Everything is forgotten if neither
+        account nor bucket is given.
+        Call this after changing an account's permissions for the change to apply immediately.
+        """
+        # Admin sets and unread indexes are worked out from bucket_access, so they go stale with it
+        # even when the access cache itself is off.
+        if self.ndb.bucket_admins:
+            if bucket is None:
+                self.ndb.bucket_admins = None
+            else:
+                self.ndb.bucket_admins.pop(bucket.id, None)
+        self.clear_unread(account if bucket is None else None)
+        if not self.ndb.access:
+            return
+        if account is None and bucket is None:
+            self.ndb.access.clear()
+            return
+        for key in [k for k in self.ndb.access if (account is None or k[0] == account.id)
+                    and (bucket is None or k[1] == bucket.id)]:
+            del self.ndb.access[key]
+
+    def access_stats(self):
+        hits, misses = self.ndb.access_hits or 0, self.ndb.access_misses or 0
+        return {'size': len(self.ndb.access or ()), 'hits': hits, 'misses': misses,
+                'hit_rate': hits / (hits + misses) if hits + misses else 0.0}
+
+    def load_due(self):
+        """
+        (Re)builds the due-date schedule from pending jobs that still have an event ahead of them.
+        """
+        self.ndb.due_heap = list()
+        self.ndb.due_index = dict()
+        self.ndb.due_live = 0
+        now = utcnow()
+        for job_id, due_date in JobDB.objects.filter(db_status=0, db_date_due__gt=now)\
+                .values_list('id', 'db_date_due').iterator():
+            self.schedule_due(job_id, due_date, arm=False)
+        heapq.heapify(self.ndb.due_heap)
+        self.arm_due()
+
+    def schedule_due(self, job_id, due_date, arm=True):
+        """
+        Queues the approaching-due and overdue events for a pending job, replacing any earlier ones.
+        Heap entries are (when, due, kind, job_id); only those in ndb.due_index are live, so replaced
+        and unscheduled entries are skipped when they come up. ndb.due_live counts the live entries.
+        Callers scheduling many jobs pass arm=False and compact and arm once afterwards.
+        """
+        if self.ndb.due_heap is None:
+            return
+        due = due_date.timestamp()
+        warning = due - self.options.due_warning.total_seconds()
+        now = utcnow().timestamp()
+        previous = self.ndb.due_index.get(job_id, set())
+        live = {(when, due, kind, job_id) for when, kind in ((warning, 'warn'), (due, 'over')) if when > now}
+        for entry in live - previous:
+            heapq.heappush(self.ndb.due_heap, entry)
+        self.ndb.due_live += len(live) - len(previous)
+        if live:
+            self.ndb.due_index[job_id] = live
+        else:
+            self.ndb.due_index.pop(job_id, None)
+        if arm:
+            self.compact_due()
+            self.arm_due()
+
+    def unschedule_due(self, job_id):
+        if self.ndb.due_index:
+            self.ndb.due_live -= len(self.ndb.due_index.pop(job_id, ()))
+            self.compact_due()
+
+    def compact_due(self):
+        """
+        Drops dead entries once they outnumber the live ones, so the heap stays proportional to the
+        pending jobs actually scheduled.
+        """
+        if self.ndb.due_heap is None:
+            return
+        if len(self.ndb.due_heap) <= 2 * self.ndb.due_live + 64:
+            return
+        self.ndb.due_heap = [entry for entries in self.ndb.due_index.values() for entry in entries]
+        heapq.heapify(self.ndb.due_heap)
+
+    def arm_due(self):
+        if self.ndb.due_timer and self.ndb.due_timer.active():
+            self.ndb.due_timer.cancel()
+        self.ndb.due_timer = None
+        if self.ndb.due_heap:
+            wait = max(self.ndb.due_heap[0][0] - utcnow().timestamp(), 0)
+            self.ndb.due_timer = reactor.callLater(wait, self.fire_due)
+
+    def fire_due(self):
+        now = utcnow().timestamp()
+        fired = list()
+        while self.ndb.due_heap and self.ndb.due_heap[0][0] <= now:
+            entry = heapq.heappop(self.ndb.due_heap)
+            when, due, kind, job_id = entry
+            live = self.ndb.due_index.get(job_id)
+            if not live or entry not in live:
+                continue
+            live.discard(entry)
+            self.ndb.due_live -= 1
+            if not live:
+                del self.ndb.due_index[job_id]
+            fired.append((kind, job_id))
+        if fired:
+            jobs = JobDB.objects.filter(id__in={job_id for kind, job_id in fired}, db_status=0).in_bulk()
+            for kind, job_id in fired:
+                job = jobs.get(job_id)
+                if not job:
+                    continue
+                if kind == 'over':
+                    job.announce("is now |rOVERDUE|n!", only_admin=True)
+                else:
+                    job.announce(f"is due in {self.options.due_warning}.", only_admin=True)
+        self.arm_due()
+
+    def performance_stats(self):
+        """
+        Rolling latency for the instrumented API methods and commands, plus the size and hit rates
+        of every cache and queue this script keeps.
+        """
+        unread = self.ndb.unread or dict()
+        return {
+            'timings': timing_summary(),
+            'caches': {
+                'access': self.access_stats(),
+                'render': self.render_stats(),
+                'unread': {'accounts': len(unread), 'jobs': sum(len(ids) for ids in unread.values())},
+                'bucket_counts': {'buckets': len(self.ndb.bucket_counts or ())},
+                'bucket_admins': {'buckets': len(self.ndb.bucket_admins or ())},
+                'job_subscribers': {'jobs': len(self.ndb.job_subscribers or ())},
+            },
+            'queues': {
+                'due_events': len(self.ndb.due_heap or ()),
+                'due_jobs': len(self.ndb.due_index or ()),
+                'read_receipts': len(self.ndb.read_receipts or ()),
+                'online': len(self.ndb.online or ()),
+                'deleting_buckets': len(self.db.deleting_buckets or ()),
+                'background': sorted(self.ndb.background or ()),
+            },
+        }
+
+    def online(self):
+        if self.ndb.online is None:
+            self.ndb.online = set(online_accounts())
+        return self.ndb.online
+
+    def at_account_login(self, sender, **kwargs):
+        self.online().add(sender)
+        if not self.ndb.bucket_admins:
+            return
+        buckets = BucketDB.objects.in_bulk(list(self.ndb.bucket_admins.keys()))
+        for bucket_id, admins in self.ndb.bucket_admins.items():
+            bucket = buckets.get(bucket_id)
+            if bucket and self.bucket_access(sender, bucket, 'admin'):
+                admins.add(sender)
+
+    def at_account_logout(self, sender, **kwargs):
+        self.online().discard(sender)
+        for admins in (self.ndb.bucket_admins or dict()).values():
+            admins.discard(sender)
+
+    def bucket_admins(self, bucket):
+        """
+        The online accounts with admin access to a Bucket. Worked out once per Bucket and then kept
+        current by logins, logouts and lock changes.
+        """
+        if self.ndb.bucket_admins is None:
+            self.ndb.bucket_admins = dict()
+        if bucket.id not in self.ndb.bucket_admins:
+            self.ndb.bucket_admins[bucket.id] = {acc for acc in self.online()
+                                                 if self.bucket_access(acc, bucket, 'admin')}
+        return self.ndb.bucket_admins[bucket.id]
+
+    def job_subscribers(self, job):
+        """
+        The accounts linked to a job, as {account: link_type}. Loaded once per job and then kept
+        current through at_job_link. Closing a job drops its entry, and the index starts over if it
+        grows past 5000 jobs.
+        """
+        if self.ndb.job_subscribers is None or len(self.ndb.job_subscribers) > 5000:
+            self.ndb.job_subscribers = dict()
+        if job.id not in self.ndb.job_subscribers:
+            self.ndb.job_subscribers[job.id] = {link.db_account: link.db_link_type for link in
+                                                JobLinkDB.objects.filter(db_job=job).select_related('db_account')}
+        return self.ndb.job_subscribers[job.id]
+
+    def bump_job(self, job_id):
+        """
+        Marks a job as changed, invalidating its cached listing rows. Versions come from one
+        ever-increasing clock, so they never repeat after the cache is reset.
+        """
+        if self.ndb.job_versions is None:
+            self.ndb.job_versions = dict()
+        self.ndb.render_clock = (self.ndb.render_clock or 0) + 1
+        self.ndb.job_versions[job_id] = self.ndb.render_clock
+
+    def job_line_statics(self, jobs):
+        """
+        The cached static part of each job's listing row, keyed by (job id, version). Jobs not bumped
+        since the cache was last reset share the version it was reset at.
+        """
+        if not self.options.render_cache:
+            return [job_line_static(job) for job in jobs]
+        cache = self.ndb.render_cache or dict()
+        versions = self.ndb.job_versions or dict()
+        floor = self.ndb.render_floor or 0
+        found, missed = list(), dict()
+        for job in jobs:
+            key = (job.id, versions.get(job.id, floor))
+            line = cache.get(key)
+            if line is None:
+                line = missed[key] = job_line_static(job)
+            found.append(line)
+        self.on_reactor(self.cache_lines, missed, len(found) - len(missed))
+        return found
+
+    def cache_lines(self, lines, hits=0):
+        if self.ndb.render_cache is None or len(self.ndb.render_cache) > 20000:
+            # Versions are dropped with the rows they guard. Rows rendered before this reset
+            # (from a worker thread, say) are below the new floor and never stored.
+            self.ndb.render_cache = dict()
+            self.ndb.job_versions = dict()
+            self.ndb.render_floor = self.ndb.render_clock or 0
+            self.ndb.render_hits = self.ndb.render_hits or 0
+            self.ndb.render_misses = self.ndb.render_misses or 0
+        floor = self.ndb.render_floor or 0
+        self.ndb.render_cache.update((key, line) for key, line in lines.items() if key[1] >= floor)
+        self.ndb.render_hits += hits
+        self.ndb.render_misses += len(lines)
+
+    def render_stats(self):
+        hits, misses = self.ndb.render_hits or 0, self.ndb.render_misses or 0
+        return {'size': len(self.ndb.render_cache or ()), 'hits': hits, 'misses': misses,
+                'hit_rate': hits / (hits + misses) if hits + misses else 0.0}
+
+    def at_job_link(self, link):
+        """
+        Called whenever a JobLink is created or its link_type changes.
+        """
+        self.bump_job(link.db_job_id)
+        if self.ndb.job_subscribers and link.db_job_id in self.ndb.job_subscribers:
+            self.ndb.job_subscribers[link.db_job_id][link.db_account] = link.db_link_type
+
+    def announce_targets(self, job, only_admin=False):
+        """
+        Who should hear about activity on a job: the Bucket's online admins plus the job's online
+        handlers (only_admin) or everyone linked to it.
+        """
+        targets = set(self.bucket_admins(job.bucket))
+        online = self.online()
+        for acc, link_type in self.job_subscribers(job).items():
+            if acc in online and (not only_admin or link_type == 2):
+                targets.add(acc)
+        return targets
+
     def buckets(self):
-        return BucketDB.objects.filter_family().order_by('db_key')
+        return BucketDB.objects.filter_family().exclude(id__in=self.db.deleting_buckets or ()).order_by('db_key')
 
     def visible_buckets(self, account):
-        return [b for b in self.buckets() if b.access(account, 'see')]
+        # Typeclass instances are cached for the server's lifetime, so they're always loaded from the primary.
+        with routers.primary():
+            buckets = list(self.buckets())
+        return [b for b in buckets if self.bucket_access(account, b, 'see')]
+
+    def status_counts(self):
+        """
+        Per-Bucket job counts by status, as {bucket_id: {status: count}}. Loaded with one grouped
+        query and then kept current by make_job, move_job and status changes.
+        """
+        if self.ndb.bucket_counts is None:
+            counts = dict()
+            with routers.primary():
+                for bucket_id, status, total in JobDB.objects.values('db_bucket', 'db_status')\
+                        .annotate(total=Count('id')).values_list('db_bucket', 'db_status', 'total'):
+                    counts.setdefault(bucket_id, dict())[status] = total
+            if not isInIOThread():
+                # Counts loaded off the reactor could miss an adjust_count, so the reactor loads its own.
+                reactor.callFromThread(self.status_counts)
+                return counts
+            self.ndb.bucket_counts = counts
+        return self.ndb.bucket_counts
+
+    def clear_counts(self):
+        self.ndb.bucket_counts = None
+
+    def adjust_count(self, bucket_id, status, change=1):
+        if self.ndb.bucket_counts is None:
+            return
+        bucket_counts = self.ndb.bucket_counts.setdefault(bucket_id, dict())
+        bucket_counts[status] = bucket_counts.get(status, 0) + change
+
+    def count_listing(self, bucket, mode):
+        """
+        Size of one of a Bucket's listings ('pending' or 'old') from the count cache. None if the
+        cache is disabled or the listing ('display') isn't a plain sum of statuses.
+        """
+        statuses = {'pending': (0, ), 'old': (1, 2, 3)}.get(mode)
+        if not self.options.count_cache or statuses is None:
+            return None
+        found = self.status_counts().get(bucket.id, dict())
+        return sum(found.get(status, 0) for status in statuses)
+
+    @timed('bucket_summary')
+    def bucket_summary(self, account):
+        """
+        Counts every visible Bucket's jobs by status, plus overdue, in a single grouped query.
+
+        Returns:
+            list of (bucket, {'pending': int, 'approved': int, 'denied': int, 'canceled': int, 'overdue': int})
+        """
+        buckets = self.visible_buckets(account)
+        if not buckets:
+            return list()
+        bucket_ids = [b.id for b in buckets]
+        overdue = Q(db_status=0, db_date_due__lt=utcnow())
+        if self.options.count_cache:
+            counts = self.status_counts()
+            late = dict(JobDB.objects.filter(overdue, db_bucket_id__in=bucket_ids).values('db_bucket')
+                        .annotate(total=Count('id')).values_list('db_bucket', 'total'))
+            summary = dict()
+            for bucket_id in bucket_ids:
+                found = counts.get(bucket_id, dict())
+                summary[bucket_id] = {name: found.get(status, 0) for status, name in _JOB_STATUS_COUNTS.items()}
+                summary[bucket_id]['overdue'] = late.get(bucket_id, 0)
+        else:
+            if self.ndb.bucket_counts is not None:
+                self.on_reactor(self.clear_counts)
+            annotations = {name: Count('id', filter=Q(db_status=status)) for status, name in _JOB_STATUS_COUNTS.items()}
+            annotations['overdue'] = Count('id', filter=overdue)
+            summary = {row.pop('db_bucket'): row for row in JobDB.objects.filter(db_bucket_id__in=bucket_ids)
+                       .values('db_bucket').annotate(**annotations)}
+        empty = {name: 0 for name in list(_JOB_STATUS_COUNTS.values()) + ['overdue']}
+        return [(bucket, summary.get(bucket.id, empty)) for bucket in buckets]
+
+    def admin_bucket_ids(self, account):
+        """
+        The ids of the Buckets account can administer, as of the access cache.
+        """
+        return [b.id for b in self.visible_buckets(account) if self.bucket_access(account, b, 'admin')]
+
+    def unread_index(self, account):
+        """
+        The ids of jobs in an account's admin Buckets with activity it hasn't read yet. Built with
+        one query the first time it's needed, then kept current by at_job_comment and mark_read.
+        """
+        if self.ndb.unread and account in self.ndb.unread:
+            return self.ndb.unread[account]
+        bucket_ids = self.admin_bucket_ids(account)
+        checked = JobLinkDB.objects.filter(db_job=OuterRef('pk'), db_account=account).values('db_date_checked')
+        unread = JobDB.objects.filter(db_bucket_id__in=bucket_ids, db_date_created__gte=utcnow() - duration('14d'))\
+            .annotate(checked=Subquery(checked[:1])).filter(Q(checked=None) | Q(db_date_admin_update__gt=F('checked')))
+        receipts = self.ndb.read_receipts or dict()
+        with routers.primary():
+            found = list(unread.values_list('id', 'db_date_admin_update'))
+        unread = {job_id for job_id, updated in found
+                  if not updated or receipts.get((account.id, job_id), updated) <= updated}
+        if not isInIOThread():
+            # Activity between this read and the reactor's turn would be lost, so it builds its own.
+            reactor.callFromThread(self.unread_index, account)
+            return unread
+        if self.ndb.unread is None:
+            self.ndb.unread = dict()
+        self.ndb.unread[account] = unread
+        return unread
+
+    @timed('unread_jobs')
+    def unread_jobs(self, account):
+        """
+        The account's unread jobs as JobRows, grouped by Bucket name and newest first. Jobs that have
+        since moved out of the account's admin Buckets are left out.
+        """
+        unread = self.unread_index(account)
+        if not unread:
+            return list()
+        return JobRow.fetch(JobDB.objects.filter(id__in=unread, db_bucket_id__in=self.admin_bucket_ids(account),
+                                                 db_date_created__gte=utcnow() - duration('14d'))
+                            .order_by('db_bucket__db_key', '-id'))
+
+    def mark_read(self, account, job):
+        """
+        Records that account has just read job. The link's check date is written on the next
+        flush_receipts(), so viewing a job costs no database write.
+        """
+        if not isInIOThread():
+            reactor.callFromThread(self.mark_read, account, job)
+            return
+        if self.ndb.read_receipts is None:
+            self.ndb.read_receipts = dict()
+        self.ndb.read_receipts[(account.id, job.id)] = utcnow()
+        if self.ndb.unread and account in self.ndb.unread:
+            self.ndb.unread[account].discard(job.id)
+
+    def read_receipts(self, account, job_ids):
+        """
+        Unflushed read times for account among job_ids, as {job_id: datetime}.
+        """
+        receipts = self.ndb.read_receipts
+        if not receipts:
+            return dict()
+        return {job_id: receipts[(account.id, job_id)] for job_id in job_ids if (account.id, job_id) in receipts}
+
+    def flush_receipts(self):
+        """
+        Writes every buffered read receipt: one bulk update for existing links and one bulk insert
+        for accounts that had never opened the job before.
+        """
+        receipts = self.ndb.read_receipts
+        if not receipts:
+            return
+        # Reads recorded while this runs go into a fresh buffer; a failed write puts these back.
+        self.ndb.read_receipts = dict()
+        account_ids = {account_id for account_id, job_id in receipts}
+        job_ids = {job_id for account_id, job_id in receipts}
+        try:
+            with transaction.atomic():
+                links = [link for link in JobLinkDB.objects.filter(db_account_id__in=account_ids,
+                                                                   db_job_id__in=job_ids)
+                         if (link.db_account_id, link.db_job_id) in receipts]
+                for link in links:
+                    link.db_date_checked = receipts[(link.db_account_id, link.db_job_id)]
+                JobLinkDB.objects.bulk_update(links, ['db_date_checked'])
+                found = {(link.db_account_id, link.db_job_id) for link in links}
+                created = [JobLinkDB(db_account_id=account_id, db_job_id=job_id, db_date_checked=checked)
+                           for (account_id, job_id), checked in receipts.items() if (account_id, job_id) not in found]
+                JobLinkDB.objects.bulk_create(created)
+        except Exception:
+            receipts.update(self.ndb.read_receipts or dict())
+            self.ndb.read_receipts = receipts
+            raise
+        for link in created:
+            self.at_job_link(link)
+
+    def clear_unread(self, account=None):
+        if account is None:
+            self.ndb.unread = None
+        elif self.ndb.unread:
+            self.ndb.unread.pop(account, None)
+
+    def at_job_comment(self, link, comment):
+        """
+        Called by DefaultJobLink.make_comment after a comment is saved.
+        """
+        self.at_job_comments([(link, comment)])
+
+    def at_job_comments(self, posted):
+        """
+        at_job_comment for many (link, comment) pairs at once, with one search-index write for all of them.
+        """
+        search.index_comments((comment, link.job) for link, comment in posted)
+        for link, comment in posted:
+            self.bump_job(link.db_job_id)
+            self.mark_unread(link.job, link.account)
+
+    def mark_unread(self, job, poster=None):
+        if self.ndb.unread:
+            for account, unread in self.ndb.unread.items():
+                if account != poster and self.bucket_access(account, job.bucket, 'admin'):
+                    unread.add(job.id)
+
+    @timed('search_jobs')
+    def search_jobs(self, account, text=None, limit=30):
+        if not text:
+            raise ValueError("Must enter something to search for!")
+        job_ids = search.search(text, admin_buckets=self.admin_bucket_ids(account), account=account, limit=limit)
+        found = JobDB.objects.in_bulk(job_ids)
+        missing = [job_id for job_id in job_ids if job_id not in found]
+        if missing:
+            found.update(JobArchiveDB.objects.in_bulk(missing))
+        return [found[job_id] for job_id in job_ids if job_id in found]
+
+    def in_background(self, account, name, work, finished):
+        """
+        Runs work() on a worker thread, so a long export, import or rebuild doesn't stall the reactor,
+        then calls finished(result) back on the reactor. Only one of each named task runs at a time.
+
+        Returns:
+            Deferred that fires after finished.
+        """
+        if self.ndb.background is None:
+            self.ndb.background = set()
+        running = self.ndb.background
+        if name in running:
+            raise ValueError(f"A job {name} is already running.")
+        running.add(name)
+
+        def run():
+            try:
+                return work()
+            finally:
+                close_old_connections()
+
+        def failed(failure):
+            logger.log_err(f"Job {name} for {account} failed: {failure.getTraceback()}")
+            self.msg_target(f"Job {name} failed: {failure.getErrorMessage()}", account)
+
+        self.msg_target(f"Job {name} started. You'll be told when it's done.", account)
+        d = threads.deferToThread(run)
+        d.addCallbacks(finished, failed)
+        d.addBoth(lambda result: running.discard(name))
+        return d
+
+    def export_jobs(self, account, path=None, chunk_size=2000):
+        """
+        Streams the whole job database to path as JSONL (gzipped if path ends in .gz), on a worker thread.
+        """
+        if not account.is_superuser:
+            raise ValueError("Permission denied. Superuser only.")
+        if not path:
+            raise ValueError("Must enter a file path!")
+        self.flush_receipts()
+
+        def work():
+            with transfer.open_stream(path, 'w') as stream:
+                return transfer.export(stream, chunk_size=chunk_size)
+
+        def finished(counts):
+            self.msg_target(f"Exported to {path}: " + ', '.join(f"{v} {k}s" for k, v in counts.items()), account)
+            return counts
+
+        return self.in_background(account, 'export', work, finished)
+
+    def at_import(self, account, announce):
+        # Imports bypass every cache, so everything built from the job tables starts over.
+        self.ndb.bucket_counts = None
+        self.clear_access()
+        self.load_due()
+        self.alert(announce, enactor=account)
+        self.msg_target(announce, account)
+
+    def import_jobs(self, account, path=None, batch_size=1000):
+        """
+        Loads a JSONL file written by export_jobs, on a worker thread. Links to accounts this server
+        doesn't have are given to the importing account.
+        """
+        if not account.is_superuser:
+            raise ValueError("Permission denied. Superuser only.")
+        if not path:
+            raise ValueError("Must enter a file path!")
+
+        def work():
+            with transfer.open_stream(path, 'r') as stream:
+                return transfer.load(stream, account, batch_size=batch_size)
+
+        def finished(counts):
+            self.at_import(account, f"Imported from {path}: " + ', '.join(f"{v} {k}s" for k, v in counts.items()))
+            return counts
+
+        return self.in_background(account, 'import', work, finished)
+
+    def import_legacy(self, account, path=None, batch_size=500):
+        """
+        Imports a softcode +jobs flat-file dump (see athanor.jobs.legacy) on a worker thread. Progress
+        is checkpointed beside the dump, so an interrupted import resumes where it stopped when run again.
+        """
+        if not account.is_superuser:
+            raise ValueError("Permission denied. Superuser only.")
+        if not path:
+            raise ValueError("Must enter a file path!")
+        locks, due = self.options.bucket_locks, self.options.bucket_due
+
+        def work():
+            return legacy.LegacyImporter(path, account, batch_size=batch_size, locks=locks, due=due).run()
+
+        def finished(counts):
+            self.at_import(account, f"Imported legacy jobs from {path}: " +
+                           ', '.join(f"{v} {k}" for k, v in counts.items()))
+            self.msg_target("Run +jbucket/reindex to make them searchable.", account)
+            return counts
+
+        return self.in_background(account, 'import', work, finished)
+
+    def find_archived(self, account, job=None):
+        """
+        Looks up an archived job by its original id. Returns None if there's no such archive. The same
+        accounts that could read the live job can read its archive: Bucket admins and the job's owner,
+        handlers and helpers.
+        """
+        job_id = unsigned_integer(job, option_key='Job ID')
+        found = JobArchiveDB.objects.filter(id=job_id).select_related('db_bucket').first()
+        if not found:
+            return None
+        if found.db_bucket and self.bucket_access(account, found.db_bucket, 'admin'):
+            return found
+        if found.db_owner_id == account.id:
+            return found
+        links, comments = archive.transcript(found)
+        if any(link['account'] == account.id and link['link_type'] > 0 for link in links):
+            return found
+        raise ValueError("Permission denied.")
+
+    def archive_jobs(self, account=None, age=None, buckets=None, limit=200):
+        """
+        Moves one batch of jobs closed longer than age (default: the archive_age option) into the
+        archive. Returns the archived job ids.
+        """
+        if account is not None and not account.is_superuser:
+            raise ValueError("Permission denied. Superuser only.")
+        age = age if age is not None else self.options.archive_age
+        archived = archive.archive_jobs(utcnow() - age, buckets=buckets, limit=limit)
+        self.forget_jobs(archived)
+        job_ids = [job_id for job_id, bucket_id, status in archived]
+        if account is not None:
+            self.msg_target(f"Archived {len(job_ids)} jobs.", account)
+        return job_ids
+
+    def rebuild_search(self, account):
+        if not account.is_superuser:
+            raise ValueError("Permission denied. Superuser only.")
+        return self.in_background(account, 'reindex', search.rebuild,
+                                  lambda result: self.msg_target("Job search index rebuilt.", account))
 
     def create_bucket(self, account, name=None, description=None):
         if not self.access(account, 'admin'):
@@ -36,6 +733,8 @@ class JobManager(AthanorGlobalScript):
         new_bucket = BucketDB.objects.create(key=name, lock_storage=self.options.bucket_locks,
                                               due=self.options.bucket_due, description=description)
         new_bucket.save()
+        self.adjust_count(new_bucket.id, 0, 0)
+        self.clear_access()
         announce = f"Bucket Created: {new_bucket.key}"
         self.alert(announce, enactor=account)
         self.msg_target(announce, account)
@@ -52,6 +751,10 @@ class JobManager(AthanorGlobalScript):
         return found
 
     def delete_bucket(self, account, bucket_name=None):
+        """
+        Hides a Bucket at once and queues it for deletion. Its jobs are deleted a batch at a time by
+        retention_tick(), and the Bucket itself once it's empty.
+        """
         if not account.is_superuser:
             raise ValueError("Permission denied. Superuser only.")
         bucket = self.find_bucket(account, bucket_name)
@@ -60,7 +763,122 @@ class JobManager(AthanorGlobalScript):
         announce = f"Bucket '{bucket}' |rDELETED|n!"
         self.alert(announce, enactor=account)
         self.msg_target(announce, account)
-        bucket.delete()
+        self.db.deleting_buckets = list(self.db.deleting_buckets or ()) + [bucket.id]
+        if self.ndb.bucket_counts is not None:
+            self.ndb.bucket_counts.pop(bucket.id, None)
+        self.clear_access(bucket=bucket)
+
+    def set_retention(self, account, bucket=None, policy=None):
+        """
+        Sets a Bucket's retention policy from '<purge|archive> <age>', or clears it with 'none'.
+        """
+        if not account.is_superuser:
+            raise ValueError("Permission denied. Superuser only.")
+        bucket = self.find_bucket(account, bucket)
+        if not policy:
+            raise ValueError("Must enter a policy: purge <age>, archive <age> or none.")
+        action, _, age = policy.strip().partition(' ')
+        action = action.lower()
+        if action == 'none':
+            retention.set_policy(bucket)
+            announce = f"Bucket '{bucket}' no longer purges or archives old jobs."
+        else:
+            age = duration(age, option_key='Retention Age') if age.strip() else None
+            retention.set_policy(bucket, action, age)
+            announce = f"Bucket '{bucket}' will {action} jobs closed longer than " \
+                       f"{time_format(age.total_seconds(), style=2)}."
+        self.alert(announce, enactor=account)
+        self.msg_target(announce, account)
+
+    def retention_tick(self):
+        """
+        Works through queued Bucket deletions and then Bucket retention policies in batches of the
+        retention_batch option, until the retention_budget option's time is used up.
+        """
+        deadline = time.perf_counter() + self.options.retention_budget / 1000
+        if self.ndb.retention_progress is None:
+            self.ndb.retention_progress = dict()
+        progress = self.ndb.retention_progress
+        limit = self.options.retention_batch
+        for bucket_id in list(self.db.deleting_buckets or ()):
+            bucket = BucketDB.objects.filter(id=bucket_id).first()
+            while bucket and time.perf_counter() < deadline:
+                found = list(bucket.jobs.order_by('id').values_list('id', 'db_bucket', 'db_status')[:limit])
+                if not found:
+                    break
+                job_ids = [job_id for job_id, bucket_id, status in found]
+                retention.delete_jobs(job_ids)
+                self.forget_jobs(found)
+                done = progress.setdefault(bucket_id, {'purged': 0, 'archived': 0})
+                done['purged'] += len(job_ids)
+            if time.perf_counter() >= deadline:
+                return
+            if bucket:
+                name = bucket.key
+                bucket.delete()
+                self.alert(f"Bucket '{name}' finished deleting: "
+                           f"{progress.get(bucket_id, dict()).get('purged', 0)} jobs removed.", enactor=None)
+            self.db.deleting_buckets = [other for other in self.db.deleting_buckets if other != bucket_id]
+            progress.pop(bucket_id, None)
+            if self.ndb.bucket_counts is not None:
+                self.ndb.bucket_counts.pop(bucket_id, None)
+        now = utcnow()
+        for bucket in self.buckets():
+            policy = retention.get_policy(bucket)
+            if not policy:
+                continue
+            action, age = policy
+            while time.perf_counter() < deadline:
+                if action == 'archive':
+                    job_ids = self.archive_jobs(age=age, buckets=[bucket], limit=limit)
+                else:
+                    found = list(retention.expired(bucket, now - age).order_by('id')
+                                 .values_list('id', 'db_bucket', 'db_status')[:limit])
+                    job_ids = [job_id for job_id, bucket_id, status in found]
+                    retention.delete_jobs(job_ids)
+                    self.forget_jobs(found)
+                if not job_ids:
+                    break
+                done = progress.setdefault(bucket.id, {'purged': 0, 'archived': 0})
+                done['archived' if action == 'archive' else 'purged'] += len(job_ids)
+            if time.perf_counter() >= deadline:
+                return
+
+    def forget_jobs(self, jobs):
+        """
+        Drops deleted jobs, given as (job id, bucket id, status), from every in-memory index.
+        """
+        if not jobs:
+            return
+        job_ids = {job_id for job_id, bucket_id, status in jobs}
+        for unread in (self.ndb.unread or dict()).values():
+            unread.difference_update(job_ids)
+        for job_id, bucket_id, status in jobs:
+            self.adjust_count(bucket_id, status, -1)
+            (self.ndb.job_subscribers or dict()).pop(job_id, None)
+            self.unschedule_due(job_id)
+
+    def retention_status(self, account):
+        """
+        Queued Bucket deletions and retention policies, with jobs handled since the last reload and
+        jobs still waiting.
+        """
+        if not account.is_superuser:
+            raise ValueError("Permission denied. Superuser only.")
+        progress = self.ndb.retention_progress or dict()
+        rows = list()
+        for bucket in BucketDB.objects.filter(id__in=self.db.deleting_buckets or ()):
+            rows.append((bucket.key, 'delete', None, progress.get(bucket.id, dict()).get('purged', 0),
+                         bucket.jobs.count()))
+        now = utcnow()
+        for bucket in self.buckets():
+            policy = retention.get_policy(bucket)
+            if not policy:
+                continue
+            action, age = policy
+            done = progress.get(bucket.id, dict()).get('archived' if action == 'archive' else 'purged', 0)
+            rows.append((bucket.key, action, age, done, retention.expired(bucket, now - age).count()))
+        return rows
 
     def lock_bucket(self, account, bucket=None, locks=None):
         if not account.is_superuser:
@@ -73,6 +891,7 @@ class JobManager(AthanorGlobalScript):
             bucket.save(update_fields=['lock_storage'])
         except LockException as e:
             raise ValueError(str(e))
+        self.clear_access(bucket=bucket)
         announce = f"Bucket '{bucket}' locks changed to: {new_locks}"
         self.alert(announce, enactor=account)
         self.msg_target(announce, account)
@@ -116,35 +935,67 @@ class JobManager(AthanorGlobalScript):
         self.alert(announce, enactor=account)
         self.msg_target(announce, account)
 
+    @timed('create_job')
     def create_job(self, account, bucket=None, subject=None, opening=None):
         bucket = self.find_bucket(account, bucket)
-        if not bucket.access(account, 'post'):
+        if not self.bucket_access(account, bucket, 'post'):
             raise ValueError("Permission denied.")
         if not subject:
             raise ValueError("Must enter a subject!")
         if not opening:
             raise ValueError("Must enter opening statement!")
         job = bucket.make_job(account, title=subject, opening=opening)
+        self.adjust_count(bucket.id, 0)
+        self.schedule_due(job.id, job.db_date_due)
         return job
 
+    @timed('create_jobs')
+    def create_jobs(self, account, bucket=None, entries=None):
+        """
+        Files many jobs into one Bucket at once. See DefaultBucket.make_jobs.
+
+        Args:
+            entries (list): (subject, opening) pairs.
+        """
+        bucket = self.find_bucket(account, bucket)
+        if not self.bucket_access(account, bucket, 'post'):
+            raise ValueError("Permission denied.")
+        if not entries:
+            raise ValueError("Must provide jobs to create!")
+        for subject, opening in entries:
+            if not subject:
+                raise ValueError("Must enter a subject!")
+            if not opening:
+                raise ValueError("Must enter opening statement!")
+        jobs = bucket.make_jobs(account, entries)
+        self.adjust_count(bucket.id, 0, len(jobs))
+        for job in jobs:
+            self.schedule_due(job.id, job.db_date_due, arm=False)
+        self.compact_due()
+        self.arm_due()
+        return jobs
+
+    @timed('find_job')
     def find_job(self, account, job=None, check_access=True):
         if isinstance(job, JobDB):
             return job
         job_id = unsigned_integer(job, option_key='Job ID')
-        found = JobDB.objects.filter(id=job_id).first()
+        with routers.primary():
+            found = JobDB.objects.filter(id=job_id).first()
         if not found:
             raise ValueError("Job not found!")
         if not check_access:
             return found
-        if found.bucket.access(account, 'admin'):
+        if self.bucket_access(account, found.bucket, 'admin'):
             return found
-        if found.links.filter(account_stub=account.stub, link_type__gt=0).exists():
+        if found.links.filter(db_account=account, db_link_type__gt=0).exists():
             return found
 
         raise ValueError("Permission denied.")
 
     def promote_account(self, account, job=None, target_account=None, show_word="Handler", rank=2, start_type=2):
         results = self.change_link_type(account, job, target_account, link_type=rank, show_word=show_word, start_type=start_type)
+        self.clear_access(account=target_account)
         job = results.job
         announce = f"{account} appointed a new new {show_word}: {target_account}"
         job.announce(announce)
@@ -154,6 +1005,7 @@ class JobManager(AthanorGlobalScript):
 
     def demote_account(self, account, job=None, target_account=None, show_word="Handler", rank=0, start_type=2):
         results = self.change_link_type(account, job, target_account, link_type=rank, start_type=start_type, show_word=show_word)
+        self.clear_access(account=target_account)
         job = results.job
         announce = f"{account} removed a {show_word}: {target_account}"
         job.announce(announce)
@@ -163,9 +1015,9 @@ class JobManager(AthanorGlobalScript):
 
     def change_link_type(self, account, job=None, target_account=None, link_type=None, start_type=None, show_word=None):
         job = self.find_job(account, job)
-        if not job.bucket.access(account, "admin"):
+        if not self.bucket_access(account, job.bucket, "admin"):
             raise ValueError("Permission denied.")
-        link, created = job.links.get_or_create(account_stub=target_account.stub)
+        link, created = job.links.get_or_create(db_account=target_account)
         if start_type and link.link_type != start_type:
             raise ValueError(f"{target_account} is not a {show_word}!")
         if link_type not in (0, 1, 2, 3):
@@ -173,33 +1025,168 @@ class JobManager(AthanorGlobalScript):
         if link_type > 0 and start_type is not None:
             if link.link_type != start_type:
                 raise ValueError("Must first demote this account before changing account status.")
-        link.link_type = link_type
-        link.save()
+        with transaction.atomic():
+            link.link_type = link_type
+            link.save()
+            job.refresh_links()
+        self.at_job_link(link)
         return link
 
     def move_job(self, account, job=None, destination=None):
         job = self.find_job(account, job)
         old_bucket = job.bucket
-        if not old_bucket.access(self.account, "admin"):
+        if not self.bucket_access(account, old_bucket, "admin"):
             raise ValueError("Permission denied.")
         destination = self.find_bucket(account, destination)
-        if not destination.access(self.account, "admin"):
+        if not self.bucket_access(account, destination, "admin"):
             raise ValueError("Permission denied.")
         announce = f'{account} moved job to: {destination}'
         job.bucket = destination
         job.save(update_fields=['bucket', ])
+        self.adjust_count(old_bucket.id, job.db_status, -1)
+        self.adjust_count(destination.id, job.db_status)
         job.make_comment(account=account, comment_mode=3, text='%s to %s' % (old_bucket, destination))
 
-    def change_job_status(self, account, job=None, new_status=None):
+    def change_job_status(self, account, job=None, new_status=None, text=None):
         job = self.find_job(account, job)
+        return self.change_jobs_status(account, [job], new_status, text=text)
+
+    def parse_job_ids(self, jobs):
+        """
+        Turns '12', '12,15' or '20-30' (or any comma-separated mix) into a list of job ids.
+        """
+        found = list()
+        for part in str(jobs).split(','):
+            part = part.strip()
+            if not part:
+                continue
+            match = _RE_JOB_RANGE.match(part)
+            if match:
+                start, end = sorted((int(match.group(1)), int(match.group(2))))
+                if end - start > 5000:
+                    raise ValueError("Job ranges may cover at most 5000 jobs.")
+                found.extend(range(start, end + 1))
+            else:
+                found.append(unsigned_integer(part, option_key='Job ID'))
+        if not found:
+            raise ValueError("Must enter one or more Job IDs!")
+        return found
+
+    def change_jobs_status(self, account, jobs=None, new_status=None, text=None):
+        """
+        Approves, denies, cancels or revives many jobs at once. Access is checked once per Bucket, and
+        every status change, status comment and header update is written in one transaction.
+
+        Args:
+            account (AccountDB): Who's doing it. Must be an admin of every affected Bucket.
+            jobs (str, list or QuerySet): Job ID spec for parse_job_ids, a list of jobs/ids, or a JobDB QuerySet.
+            new_status (int): 0 = Pending (revive), 1 = Approved, 2 = Denied, 3 = Canceled.
+            text (str): Optional comment text. Defaults to a plain statement of the change.
+
+        Returns:
+            list of changed jobs.
+        """
+        if new_status not in _JOB_STATUS_CHANGE:
+            raise ValueError("Invalid job status!")
+        comment_mode, verb = _JOB_STATUS_CHANGE[new_status]
+        if isinstance(jobs, QuerySet):
+            found = jobs
+        else:
+            if isinstance(jobs, str):
+                jobs = self.parse_job_ids(jobs)
+            found = JobDB.objects.filter(id__in=[j.id if isinstance(j, JobDB) else int(j) for j in jobs])
+        found = found.exclude(db_status=0) if new_status == 0 else found.filter(db_status=0)
+        text = text or f"{account} {verb} the job."
+        now = utcnow()
+        poster = str(account)[:255]
+
+        with transaction.atomic():
+            # of=('self',) so only the jobs are locked, not the Buckets joined in with them.
+            jobs = list(found.select_related('db_bucket').select_for_update(of=('self',)).order_by('id'))
+            if not jobs:
+                raise ValueError(f"No jobs found that can be {verb}.")
+            denied = {job.bucket for job in jobs if not self.bucket_access(account, job.bucket, 'admin')}
+            if denied:
+                raise ValueError(f"Permission denied for: {', '.join(sorted(str(b) for b in denied))}")
+            job_ids = [job.id for job in jobs]
+
+            links = dict(JobLinkDB.objects.filter(db_job_id__in=job_ids, db_account=account)
+                         .values_list('db_job', 'id'))
+            missing = [job_id for job_id in job_ids if job_id not in links]
+            created = list()
+            if missing:
+                JobLinkDB.objects.bulk_create([JobLinkDB(db_job_id=job_id, db_account=account) for job_id in missing])
+                created = list(JobLinkDB.objects.filter(db_job_id__in=missing, db_account=account))
+                links.update({link.db_job_id: link.id for link in created})
+            JobCommentDB.objects.bulk_create([JobCommentDB(db_link_id=links[job_id], db_comment_mode=comment_mode,
+                                                           db_text=text) for job_id in job_ids])
+            comments = dict(JobCommentDB.objects.filter(db_link_id__in=links.values(), db_comment_mode=comment_mode)
+                            .values('db_link__db_job').annotate(last=Max('id')).values_list('db_link__db_job', 'last'))
+            terms = search.tokenize(text)
+            search.index_many({(job_id, False): terms for job_id in job_ids})
+
+            old_status = dict()
+            for job in jobs:
+                old_status[job.id] = job.db_status
+                job.db_status = new_status
+                job.db_date_closed = None if new_status == 0 else now
+                job.db_date_admin_update = job.db_date_public_update = now
+                job.db_last_admin_id = job.db_last_public_id = comments.get(job.id)
+                job.db_last_admin_poster = job.db_last_public_poster = poster
+                job.db_comment_count += 1
+            JobDB.objects.bulk_update(jobs, ['db_status', 'db_date_closed', 'db_date_admin_update',
+                                             'db_date_public_update', 'db_last_admin', 'db_last_public',
+                                             'db_last_admin_poster', 'db_last_public_poster', 'db_comment_count'])
+
+        for link in created:
+            self.at_job_link(link)
+        for job in jobs:
+            self.adjust_count(job.db_bucket_id, old_status[job.id], -1)
+            self.adjust_count(job.db_bucket_id, new_status)
+            if new_status == 0:
+                self.schedule_due(job.id, job.db_date_due, arm=False)
+            else:
+                self.unschedule_due(job.id)
+                (self.ndb.job_subscribers or dict()).pop(job.id, None)
+            self.mark_unread(job, account)
+            self.bump_job(job.id)
+        if new_status == 0:
+            self.compact_due()
+            self.arm_due()
+        self.announce_status(account, jobs, verb)
+        return jobs
+
+    def announce_status(self, account, jobs, verb):
+        """
+        Sends each interested online account one message covering every job in a bulk change.
+        """
+        online = self.online()
+        linked = dict()
+        for job_id, acc_id in JobLinkDB.objects.filter(db_job_id__in=[job.id for job in jobs])\
+                .values_list('db_job', 'db_account'):
+            linked.setdefault(acc_id, set()).add(job_id)
+        by_account = dict()
+        for job in jobs:
+            targets = set(self.bucket_admins(job.bucket))
+            targets.update(acc for acc in online if job.id in linked.get(acc.id, ()))
+            for acc in targets:
+                by_account.setdefault(acc, list()).append(job)
+        for acc, acc_jobs in by_account.items():
+            by_bucket = dict()
+            for job in acc_jobs:
+                by_bucket.setdefault(job.bucket.key, list()).append(str(job.id))
+            summary = '; '.join(f"{bucket} {', '.join(ids)}" for bucket, ids in sorted(by_bucket.items()))
+            acc.msg(f"{account} {verb} {len(acc_jobs)} job{'s' if len(acc_jobs) != 1 else ''}: {summary}",
+                    system_alert='JOBS')
 
     def change_attn(self, account, job=None, new_attn=None):
         job = self.find_job(account, job)
 
+    @timed('create_comment')
     def create_comment(self, account, job=None, comment_text=None, comment_type=None, announce=True):
         job = self.find_job(account, job)
-        bucket_admin = job.bucket.access(self.account, "admin")
-        if not (bucket_admin or job.links.filter(account_stub=account.stub, link_type__gt=0).exists()):
+        bucket_admin = self.bucket_access(account, job.bucket, "admin")
+        if not (bucket_admin or job.links.filter(db_account=account, db_link_type__gt=0).exists()):
             raise ValueError("Permission denied.")
         if not comment_text:
             raise ValueError("No text provided! What do you have to say?")
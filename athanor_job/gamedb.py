@@ -1,11 +1,14 @@
+import math
+import evennia
+from athanor.jobs.profiling import timed
+from athanor.jobs.projections import JobRow, LinkRow, CommentRow, COMMENT_MODES, format_job_line, format_comment
 from athanor.jobs.models import BucketDB, JobDB, JobLinkDB, JobCommentDB
+from django.db import connection, transaction
 from django.db.models import Q, F
-from evennia.utils.utils import time_format
 from evennia.utils.ansi import ANSIString
 from evennia.utils.validatorfuncs import duration
 
 from athanor.utils.time import utcnow
-from athanor.utils.online import accounts as online_accounts
 
 
 class DefaultBucket(BucketDB):
@@ -14,55 +17,103 @@ class DefaultBucket(BucketDB):
     def create(cls, *args, **kwargs):
         pass
 
+    @timed('make_job')
     def make_job(self, account, title, opening):
+        """
+        Creates a job with its owner link and opening comment in one transaction: three INSERTs and
+        one UPDATE to point the job's header columns at the new link and comment.
+        """
         now = utcnow()
-        due = now + self.due
-        job = self.jobs.create(title=title, submit_date=now, due_date=due, admin_update=now, public_update=now)
-        job.save()
-        handler = job.links.create(account_stub=account.stub, link_type=3, check_date=now)
-        handler.make_comment(text=opening, comment_mode=0)
-        handler.latest_check()
+        owner = str(account)[:255]
+        with transaction.atomic():
+            job = self.jobs.create(db_key=title, db_date_due=now + self.due, db_date_admin_update=now,
+                                   db_date_public_update=now, db_owner_name=owner, db_comment_count=1,
+                                   db_last_admin_poster=owner, db_last_public_poster=owner)
+            link = job.links.create(db_account=account, db_link_type=3, db_date_checked=now)
+            comment = link.comments.create(db_comment_mode=0, db_text=opening)
+            job.db_owner = link
+            job.db_last_admin = job.db_last_public = comment
+            job.save(update_fields=['db_owner', 'db_last_admin', 'db_last_public'])
+        evennia.GLOBAL_SCRIPTS.jobs.at_job_comment(link, comment)
         return job
 
-    def display(self, account, mode='display', page=1, per_page=30):
-        message = list()
-        admin = self.access(account, 'admin')
-        start = (page - 1) * per_page
-        show = list()
-        if mode == 'display':
-            jobs = self.active()
-            show = list(jobs[start:start + per_page])
-        elif mode == 'old':
-            jobs = self.old()
-            show = list(jobs[start:start + per_page])
-        elif mode == 'pending':
-            jobs = self.pending()
-            show = list(jobs[:per_page])
+    @timed('make_jobs')
+    def make_jobs(self, account, entries):
+        """
+        Bulk version of make_job for scripted or imported submissions: one INSERT per table for the
+        whole batch, then one bulk UPDATE of the job headers. Falls back to make_job per entry, still
+        in a single transaction, on databases that can't return ids from a bulk insert.
+
+        Args:
+            account (AccountDB): The submitter of every job.
+            entries (list): (title, opening) pairs.
+
+        Returns:
+            list of jobs, in entry order.
+        """
+        features = connection.features
+        if not (getattr(features, 'can_return_rows_from_bulk_insert', False)
+                or getattr(features, 'can_return_ids_from_bulk_insert', False)):
+            with transaction.atomic():
+                return [self.make_job(account, title, opening) for title, opening in entries]
+        now = utcnow()
+        owner = str(account)[:255]
+        with transaction.atomic():
+            jobs = JobDB.objects.bulk_create([
+                JobDB(db_bucket=self, db_key=title, db_date_due=now + self.due, db_date_admin_update=now,
+                      db_date_public_update=now, db_owner_name=owner, db_comment_count=1,
+                      db_last_admin_poster=owner, db_last_public_poster=owner) for title, opening in entries])
+            links = JobLinkDB.objects.bulk_create([
+                JobLinkDB(db_job=job, db_account=account, db_link_type=3, db_date_checked=now) for job in jobs])
+            comments = JobCommentDB.objects.bulk_create([
+                JobCommentDB(db_link=link, db_comment_mode=0, db_text=opening)
+                for link, (title, opening) in zip(links, entries)])
+            for job, link, comment in zip(jobs, links, comments):
+                job.db_owner = link
+                job.db_last_admin = job.db_last_public = comment
+            JobDB.objects.bulk_update(jobs, ['db_owner', 'db_last_admin', 'db_last_public'])
+        evennia.GLOBAL_SCRIPTS.jobs.at_job_comments(list(zip(links, comments)))
+        return jobs
+
+    def display(self, account, mode='display', before=None, per_page=30):
+        admin = evennia.GLOBAL_SCRIPTS.jobs.bucket_access(account, self, 'admin')
+        show = self.seek(mode, before, per_page)
         show.reverse()
-        for j in show:
-            message.append(j.display_line(account, admin, mode))
-        return message
+        return render_job_lines(show, account, admin)
+
+    def listing(self, mode='display'):
+        return {'display': self.active, 'old': self.old, 'pending': self.pending}[mode]()
+
+    def seek(self, mode='display', before=None, per_page=30):
+        """
+        Keyset pagination: the next per_page jobs (newest first) with an id below before.
+        Only the requested slice is ever read, however deep into the listing it is.
+        """
+        jobs = self.listing(mode)
+        if before is not None:
+            jobs = jobs.filter(id__lt=before)
+        return JobRow.fetch(jobs[:per_page])
 
     def active(self):
         interval = utcnow() - duration('7d')
-        return self.jobs.filter(Q(status=0, close_date=None) | Q(close_date__gte=interval)).order_by('id').reverse()
+        return self.jobs.filter(Q(db_status=0, db_date_closed=None) | Q(db_date_closed__gte=interval)).order_by('-id')
 
     def pending(self):
-        return self.jobs.filter(status=0).order_by('id').reverse()
+        return self.jobs.filter(db_status=0).order_by('-id')
 
     def old(self):
-        return self.jobs.exclude(status=0).order_by('id').reverse()
+        return self.jobs.exclude(db_status=0).order_by('-id')
 
+    @timed('bucket.new')
     def new(self, viewer):
         interval = utcnow() - duration('14d')
-        unseen_ids = self.jobs.exclude(links__account_stub=viewer.stub)
-        #updated = Q(submit_date__gte=interval)
+        unseen_ids = self.jobs.exclude(links__db_account=viewer)
         unseen = Q(id__in=unseen_ids)
         if self.locks.check(viewer, 'admin'):
-            last = Q(links__account_stub=viewer.stub, admin_update__gt=F('links__check_date'))
+            last = Q(links__db_account=viewer, db_date_admin_update__gt=F('links__db_date_checked'))
         else:
-            last = Q(links__account_stub=viewer.stub, public_update__gt=F('links__check_date'))
-        jobs = self.jobs.filter(last | unseen).exclude(submit_date__lt=interval)
+            last = Q(links__db_account=viewer, db_date_public_update__gt=F('links__db_date_checked'))
+        jobs = self.jobs.filter(last | unseen).exclude(db_date_created__lt=interval)
         return jobs
 
 
@@ -73,20 +124,82 @@ class DefaultJob(JobDB):
         pass
 
     def handlers(self):
-        return self.links.filter(link_type=2)
+        return self.links.filter(db_link_type=2)
 
     def handler_names(self):
-        return ', '.join([str(hand) for hand in self.handlers()])
+        return self.db_handler_names
 
     def helpers(self):
-        return self.links.filter(link_type=1)
+        return self.links.filter(db_link_type=1)
 
     def helper_names(self):
-        return ', '.join([str(hand) for hand in self.helpers()])
+        return self.db_helper_names
+
+    def refresh_links(self):
+        """
+        Recomputes the cached owner and handler/helper names from this job's links. Call after any
+        link_type change.
+        """
+        links = LinkRow.fetch(JobLinkDB.objects.filter(db_job=self, db_link_type__gt=0).order_by('id'))
+        owner = None
+        handlers, helpers = list(), list()
+        for link in links:
+            if link.db_link_type == 3 and owner is None:
+                owner = link
+            elif link.db_link_type == 2:
+                handlers.append(str(link))
+            elif link.db_link_type == 1:
+                helpers.append(str(link))
+        self.db_owner_id = owner.id if owner else None
+        self.db_owner_name = str(owner)[:255] if owner else ''
+        self.db_handler_names = ', '.join(handlers)[:255]
+        self.db_helper_names = ', '.join(helpers)[:255]
+        self.save(update_fields=['db_owner', 'db_owner_name', 'db_handler_names', 'db_helper_names'])
+
+    def refresh_header(self):
+        """
+        Rebuilds every denormalized header column from scratch, for rows that predate them.
+        """
+        comments = self.comments().select_related('db_link__db_account')
+        last_admin = comments.last()
+        last_public = comments.exclude(db_is_private=True).last()
+        self.db_comment_count = comments.count()
+        self.db_last_admin = last_admin
+        self.db_last_admin_poster = str(last_admin.link) if last_admin else ''
+        self.db_last_public = last_public
+        self.db_last_public_poster = str(last_public.link) if last_public else ''
+        self.save(update_fields=['db_comment_count', 'db_last_admin', 'db_last_admin_poster',
+                                 'db_last_public', 'db_last_public_poster'])
+        self.refresh_links()
 
     def comments(self):
-        from features.jobs.models import JobCommentDB
-        return JobCommentDB.objects.filter_family(link__job=self).order_by('db_date_created')
+        return JobCommentDB.objects.filter_family(db_link__db_job=self).order_by('db_date_created')
+
+    def comment_page(self, admin=False, page=None, last=None, per_page=20):
+        """
+        One page of this job's comment thread, as CommentRows. Only the comments on the page are read,
+        with their posters fetched alongside them.
+
+        Args:
+            admin (bool): Include private staff comments.
+            page (int): 1-indexed page number. Defaults to the newest page.
+            last (int): Show this many of the newest comments instead of a page.
+            per_page (int): Comments per page.
+
+        Returns:
+            (comments, page, pages) where comments is a generator in posting order.
+        """
+        comments = self.comments()
+        if not admin:
+            comments = comments.exclude(db_is_private=True)
+        total = comments.count()
+        pages = max(int(math.ceil(total / per_page)), 1)
+        if last:
+            show = reversed(CommentRow.fetch(comments.reverse()[:last]))
+            return (com for com in show), pages, pages
+        page = pages if page is None else min(max(page, 1), pages)
+        start = (page - 1) * per_page
+        return (com for com in CommentRow.fetch(comments[start:start + per_page])), page, pages
 
     def status_letter(self):
         sta = {0: 'P', 1: 'A', 2: 'D', 3: 'C'}
@@ -101,8 +214,8 @@ class DefaultJob(JobDB):
 
     def get_last(self, admin=False):
         if admin:
-            return self.comments().last()
-        return self.comments().exclude(is_private=1).last()
+            return self.db_last_admin
+        return self.db_last_public
 
     def display_last(self, account, admin=False):
         date = self.public_update
@@ -115,9 +228,13 @@ class DefaultJob(JobDB):
     def __str__(self):
         return self.title
 
+    @property
+    def title(self):
+        return self.key
+
     @property
     def owner(self):
-        return self.links.filter(link_type=3).first()
+        return self.db_owner
 
     @property
     def locks(self):
@@ -130,62 +247,35 @@ class DefaultJob(JobDB):
     def announce_name(self):
         return f"{self.bucket.key} Job {self.id} '{self.title}'"
 
+    @timed('announce')
     def announce(self, message, only_admin=False):
-        online = online_accounts()
         text = f"P{self.announce_name()}: {message}"
-        admin = [acc for acc in online if self.bucket.access(acc, 'admin')]
-        targets = list()
-        if only_admin:
-            targets += admin
-            targets += self.handlers
-        else:
-            targets += admin
-            targets += [char for char in self.links.all()]
-        targets = set(targets)
-        final_list = targets.intersection(online)
-
-        for acc in final_list:
+        for acc in evennia.GLOBAL_SCRIPTS.jobs.announce_targets(self, only_admin=only_admin):
             acc.msg(text, system_alert='JOBS')
 
     def display_line(self, account, admin, mode=None):
-        start = f"{self.unread_star(account, admin)}{self.status_letter()}"
-        num = str(self.id).rjust(4).ljust(5)
-        owner_link = self.owner
-        owner = str(self.owner) if owner_link else ''
-        owner = owner[:15].ljust(16)
-        title = self.title[:29].ljust(30)
-        claimed = self.handler_names()[:12].ljust(13)
-        now = utcnow().timestamp()
-        last_updated = self.public_update.timestamp()
-        if admin:
-            last_updated = max(self.admin_update.timestamp(), last_updated)
-        due = self.due_date.timestamp() - now
-        if due <= 0:
-            due = ANSIString("|rOVER|n")
-        else:
-            due = time_format(due, 1)
-        due = due.rjust(6).ljust(7)
-        last = time_format(now - last_updated, 1).rjust(4)
-        return f"{start} {num}{owner}{title}{claimed}{due}{last}"
+        return render_job_lines([self], account, admin)[0]
 
     def unread_star(self, account, admin=False):
-        link = self.links.filter(account_stub__account=account).first()
-        if not link:
+        link = self.links.filter(db_account=account).first()
+        if not link or not link.db_date_checked:
             return ANSIString('|r*|n')
+        public_update = self.db_date_public_update or self.db_date_created
         if admin:
-            if max(self.admin_update, self.public_update) > link.check_date:
+            if max(self.db_date_admin_update or public_update, public_update) > link.db_date_checked:
                 return ANSIString('|r*|n')
             else:
                 return " "
-        if self.public_update > link.check_date:
+        if public_update > link.db_date_checked:
             return ANSIString('|r*|n')
         else:
             return " "
 
     def get_link(self, account):
-        link, created = self.links.get_or_create(account_stub=account.stub)
+        link, created = self.links.get_or_create(db_account=account)
         if created:
             link.save()
+            evennia.GLOBAL_SCRIPTS.jobs.at_job_link(link)
         return link
 
     def make_comment(self, account, comment_mode=1, text=None, is_private=False):
@@ -193,8 +283,7 @@ class DefaultJob(JobDB):
         return link.make_comment(comment_mode, text, is_private)
 
     def update_read(self, account):
-        link = self.get_link(account)
-        link.latest_check()
+        evennia.GLOBAL_SCRIPTS.jobs.mark_read(account, self)
 
 
 class DefaultJobLink(JobLinkDB):
@@ -204,17 +293,28 @@ class DefaultJobLink(JobLinkDB):
         pass
 
     def __str__(self):
-        return str(self.owner)
+        return str(self.account)
 
     def latest_check(self):
-        self.check_date = utcnow()
+        self.date_checked = utcnow()
+        self.save(update_fields=['db_date_checked'])
 
     def make_comment(self, comment_mode=1, text=None, is_private=False):
         now = utcnow()
-        if not is_private:
-            self.job.public_update = now
-        self.job.admin_update = now
-        return self.comments.create(comment_mode=comment_mode, text=text, is_private=is_private, date_made=now)
+        job = self.job
+        poster = str(self)[:255]
+        with transaction.atomic():
+            comment = self.comments.create(db_comment_mode=comment_mode, db_text=text, db_is_private=is_private)
+            updates = {'db_date_admin_update': now, 'db_last_admin': comment, 'db_last_admin_poster': poster}
+            if not is_private:
+                updates.update({'db_date_public_update': now, 'db_last_public': comment,
+                                'db_last_public_poster': poster})
+            JobDB.objects.filter(id=job.id).update(db_comment_count=F('db_comment_count') + 1, **updates)
+        for field, value in updates.items():
+            setattr(job, field, value)
+        job.db_comment_count += 1
+        evennia.GLOBAL_SCRIPTS.jobs.at_job_comment(self, comment)
+        return comment
 
     def link_type_name(self):
         return {0: 'Admin', 1: 'Helper', 2: 'Handler', 3: 'Owner'}.get(int(self.link_type))
@@ -236,19 +336,35 @@ class DefaultJobComment(JobCommentDB):
     def poster(self):
         if self.link.job.anonymous and self.link.is_owner:
             return 'Anonymous'
-        return self.link.owner
+        return self.link
 
     def action_phrase(self):
-        kind = {0: 'Opened', 1: 'Replied', 2: '|rSTAFF COMMENTED|n', 3: 'Moved', 4: 'Approved',
-                5: 'Denied', 6: 'Canceled', 7: 'Revived', 8: 'Appointed Handler', 9: 'Appointed Helper',
-                10: 'Removed Handler', 11: 'Removed Helper', 12: 'Due Date Changed'}
-        return kind.get(self.comment_mode, "Unknown")
+        return COMMENT_MODES.get(self.comment_mode, "Unknown")
 
     def display(self, viewer, admin=False):
-        show_date = viewer.display_time(time_disp=self.date_created)
-        message = f"{self.poster()} |w{self.action_phrase()} on {show_date}:|n"
-        if self.comment_mode in (3, 8, 9, 10, 11, 12):
-            message += " %s" % self.text
-        else:
-            message += "\n\n%s" % self.text
-        return message
\ No newline at end of file
+        return format_comment(self.poster(), self.comment_mode, self.date_created, self.text, viewer)
+
+
+def render_job_lines(jobs, account, admin):
+    """
+    Renders listing rows for a page of jobs. Owner and handler names come from the job rows; the
+    viewer's own links for the whole page are loaded in one query.
+
+    Args:
+        jobs (iterable): The jobs to render, in display order. JobRows or DefaultJobs.
+        account (AccountDB): The viewer.
+        admin (bool): Whether the viewer sees admin-only activity.
+
+    Returns:
+        list of str
+    """
+    jobs = list(jobs)
+    if not jobs:
+        return list()
+    job_ids = [job.id for job in jobs]
+    checked = dict(JobLinkDB.objects.filter(db_job_id__in=job_ids, db_account=account)
+                   .values_list('db_job', 'db_date_checked'))
+    checked.update(evennia.GLOBAL_SCRIPTS.jobs.read_receipts(account, job_ids))
+    static = evennia.GLOBAL_SCRIPTS.jobs.job_line_statics(jobs)
+    return [format_job_line(job, admin, linked=job.id in checked, checked=checked.get(job.id), static=line)
+            for job, line in zip(jobs, static)]
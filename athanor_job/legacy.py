@@ -0,0 +1,264 @@
+"""
+Importer for softcode +jobs systems (Anomaly Jobs and its descendants).
+
+The old system is dumped to a flat file, one record per line, fields separated by '|'. The last
+field of a record may itself contain '|', and %r / %t stand for newlines and tabs as they do in
+MUSH code. Times are seconds since the epoch, and due is a number of days.
+
+    BUCKET|<name>|<due>|<description>
+    JOB|<number>|<bucket>|<status>|<opened>|<due time>|<closed time or blank>|<title>
+    HANDLER|<number>|<name>
+    HELPER|<number>|<name>
+    COMMENT|<number>|<type>|<poster>|<time>|<text>
+
+A job's HANDLER, HELPER and COMMENT lines must follow its JOB line and come before the next one, which
+is the order a dump loop over the job objects writes them in. Because of that the importer only holds
+one job's thread in memory. It assigns ids itself, so links and comments can point at rows that
+haven't been written yet, and writes finished jobs in batches, one transaction per batch.
+
+A JSON checkpoint is saved after every batch. Re-running with the same checkpoint file picks up
+after the last batch that was committed. Legacy job numbers are kept as job ids when the job tables
+start out empty; otherwise they're shifted past the highest existing id.
+"""
+import datetime
+import json
+import os
+from django.db import transaction
+from evennia.accounts.models import AccountDB
+from evennia.objects.models import ObjectDB
+from athanor.jobs.models import BucketDB, JobDB, JobLinkDB, JobCommentDB, JobArchiveDB
+from athanor.jobs.projections import COMMENT_MODES
+from athanor.jobs.transfer import create_dated, reset_sequences
+
+# Legacy status: JobDB.db_status
+LEGACY_STATUSES = {'NEW': 0, 'OPEN': 0, 'PENDING': 0, 'HOLD': 0, 'INPROGRESS': 0, 'APPROVED': 1, 'COMPLETE': 1,
+                   'COMPLETED': 1, 'DENIED': 2, 'CANCELED': 3, 'CANCELLED': 3, 'DELETED': 3}
+
+# Legacy comment type: (comment mode, is private)
+LEGACY_COMMENTS = {'CREATE': (0, False), 'ADD': (1, False), 'REPLY': (1, False), 'MAIL': (1, False),
+                   'COMMENT': (2, True), 'NOTE': (2, True), 'TRANS': (3, False), 'MOVE': (3, False),
+                   'APPROVE': (4, False), 'COMPLETE': (4, False), 'DENY': (5, False), 'CANCEL': (6, False),
+                   'DELETE': (6, False), 'REOPEN': (7, False), 'ASSIGN': (8, False), 'HELPER': (9, False),
+                   'UNASSIGN': (10, False), 'UNHELPER': (11, False), 'DUE': (12, False)}
+
+# Record type: number of fields after the type.
+_RECORD_FIELDS = {'BUCKET': 3, 'JOB': 7, 'HANDLER': 2, 'HELPER': 2, 'COMMENT': 5}
+
+
+def _text(value):
+    return value.replace('%r', '\n').replace('%R', '\n').replace('%t', '\t').replace('%T', '\t')
+
+
+def _time(value):
+    value = value.strip()
+    if not value:
+        return None
+    return datetime.datetime.fromtimestamp(int(float(value)), datetime.timezone.utc)
+
+
+class _Thread:
+    """
+    The job being read, with the links and comments that belong to it.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.links = dict()
+        self.comments = list()
+
+
+class LegacyImporter:
+
+    def __init__(self, path, fallback_account, checkpoint=None, batch_size=500, locks='',
+                 due=datetime.timedelta(days=7)):
+        """
+        Args:
+            path (str): The flat-file dump.
+            fallback_account (AccountDB): Poster for names that match no account or character here.
+            checkpoint (str): JSON progress file. Defaults to the dump's path plus '.checkpoint'.
+            batch_size (int): Jobs per transaction.
+            locks (str): Lock string for buckets the import creates.
+            due (timedelta): Due duration for BUCKET lines that leave it blank.
+        """
+        for kind, (mode, private) in LEGACY_COMMENTS.items():
+            if mode not in COMMENT_MODES:
+                raise ValueError(f"Legacy comment type {kind} maps to unknown mode {mode}.")
+        self.path = path
+        self.fallback = fallback_account
+        self.checkpoint = checkpoint or f"{path}.checkpoint"
+        self.batch_size = batch_size
+        self.locks = locks
+        self.due = due
+        self.accounts = {key.lower(): pk for key, pk in AccountDB.objects.values_list('db_key', 'id')}
+        self.characters = dict()
+        self.thread = None
+        self.jobs, self.links, self.comments = list(), list(), list()
+        self.state = self.load_checkpoint()
+
+    def load_checkpoint(self):
+        if os.path.exists(self.checkpoint):
+            with open(self.checkpoint, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state['path'] != os.path.abspath(self.path):
+                raise ValueError(f"Checkpoint {self.checkpoint} belongs to {state['path']}.")
+            if state['done']:
+                raise ValueError(f"{self.path} has already been imported.")
+            return state
+        job_offset = max(JobDB.objects.order_by('-id').values_list('id', flat=True).first() or 0,
+                         JobArchiveDB.objects.order_by('-id').values_list('id', flat=True).first() or 0)
+        return {'path': os.path.abspath(self.path), 'line': 0, 'done': False, 'job_offset': job_offset,
+                'next_link': (JobLinkDB.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1,
+                'next_comment': (JobCommentDB.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1,
+                'buckets': dict(), 'counts': {'buckets': 0, 'jobs': 0, 'links': 0, 'comments': 0}}
+
+    def save_checkpoint(self):
+        temp = f"{self.checkpoint}.tmp"
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(temp, self.checkpoint)
+
+    def run(self):
+        """
+        Imports the dump from the last checkpoint onward.
+
+        Returns:
+            dict of buckets, jobs, links and comments imported, over every run of this dump.
+        """
+        with open(self.path, 'r', encoding='utf-8', errors='replace') as f:
+            for number, line in enumerate(f):
+                if number < self.state['line']:
+                    continue
+                line = line.rstrip('\r\n')
+                if not line.strip():
+                    continue
+                kind, _, rest = line.partition('|')
+                kind = kind.strip().upper()
+                if kind not in _RECORD_FIELDS:
+                    raise ValueError(f"Line {number + 1}: unknown record type '{kind}'.")
+                fields = rest.split('|', _RECORD_FIELDS[kind] - 1)
+                if len(fields) != _RECORD_FIELDS[kind]:
+                    raise ValueError(f"Line {number + 1}: {kind} needs {_RECORD_FIELDS[kind]} fields.")
+                if kind == 'JOB':
+                    self.finish()
+                    if len(self.jobs) >= self.batch_size:
+                        self.write(number)
+                    self.start(fields, number)
+                elif kind == 'BUCKET':
+                    self.bucket(*fields)
+                else:
+                    if self.thread is None or self.thread.job.id != int(fields[0]) + self.state['job_offset']:
+                        raise ValueError(f"Line {number + 1}: {kind} for job {fields[0]} isn't under its JOB line.")
+                    if kind == 'COMMENT':
+                        self.comment(*fields[1:])
+                    else:
+                        self.link(fields[1], 2 if kind == 'HANDLER' else 1)
+            self.finish()
+            self.write(None)
+        reset_sequences()
+        return self.state['counts']
+
+    def bucket(self, name, due, description):
+        name = name.strip()
+        found = BucketDB.objects.filter(db_key__iexact=name).first()
+        if not found:
+            due = datetime.timedelta(days=float(due)) if due.strip() else self.due
+            found = BucketDB.objects.create(db_key=name, db_lock_storage=self.locks, db_due=due,
+                                            db_description=_text(description) or None)
+            self.state['counts']['buckets'] += 1
+        self.state['buckets'][name.upper()] = found.id
+
+    def start(self, fields, number):
+        job_number, bucket, status, opened, due, closed, title = fields
+        bucket_id = self.state['buckets'].get(bucket.strip().upper())
+        if bucket_id is None:
+            found = BucketDB.objects.filter(db_key__iexact=bucket.strip()).values_list('id', flat=True).first()
+            if found is None:
+                raise ValueError(f"Line {number + 1}: job {job_number} is in unknown bucket '{bucket}'.")
+            bucket_id = self.state['buckets'][bucket.strip().upper()] = found
+        status = status.strip().upper()
+        if status not in LEGACY_STATUSES:
+            raise ValueError(f"Line {number + 1}: unknown job status '{status}'.")
+        opened = _time(opened)
+        self.thread = _Thread(JobDB(id=int(job_number) + self.state['job_offset'], db_key=_text(title)[:255],
+                                    db_bucket_id=bucket_id, db_status=LEGACY_STATUSES[status],
+                                    db_date_created=opened, db_date_due=_time(due) or opened,
+                                    db_date_closed=_time(closed)))
+
+    def poster(self, name):
+        name = name.strip()
+        key = name.lower()
+        if key not in self.characters:
+            self.characters[key] = ObjectDB.objects.filter(db_key__iexact=name).values_list(
+                'id', 'db_account').first() or (None, None)
+        character, account = self.characters[key]
+        return self.accounts.get(key) or account or self.fallback.id, character
+
+    def link(self, name, link_type):
+        found = self.thread.links.get(name.strip().lower())
+        if found is None:
+            account, character = self.poster(name)
+            found = JobLinkDB(id=self.state['next_link'], db_job_id=self.thread.job.id, db_account_id=account,
+                              db_character_id=character, db_link_type=link_type)
+            found.legacy_name = name.strip()
+            self.state['next_link'] += 1
+            self.thread.links[name.strip().lower()] = found
+        elif link_type > found.db_link_type:
+            found.db_link_type = link_type
+        return found
+
+    def comment(self, kind, poster, date, text):
+        kind = kind.strip().upper()
+        if kind not in LEGACY_COMMENTS:
+            raise ValueError(f"Unknown legacy comment type '{kind}'.")
+        mode, private = LEGACY_COMMENTS[kind]
+        link = self.link(poster, 3 if mode == 0 else 0)
+        comment = JobCommentDB(id=self.state['next_comment'], db_link_id=link.id, db_comment_mode=mode,
+                               db_is_private=private, db_text=_text(text),
+                               db_date_created=_time(date) or self.thread.job.db_date_created)
+        self.state['next_comment'] += 1
+        self.thread.comments.append((link, comment))
+
+    def finish(self):
+        """
+        Fills in the job's denormalized header from its thread and queues its rows.
+        """
+        if self.thread is None:
+            return
+        job = self.thread.job
+        links = sorted(self.thread.links.values(), key=lambda l: l.id)
+        owner = next((l for l in links if l.db_link_type == 3), None)
+        job.db_owner_id = owner.id if owner else None
+        job.db_owner_name = owner.legacy_name[:255] if owner else ''
+        job.db_handler_names = ', '.join(l.legacy_name for l in links if l.db_link_type == 2)[:255]
+        job.db_helper_names = ', '.join(l.legacy_name for l in links if l.db_link_type == 1)[:255]
+        job.db_comment_count = len(self.thread.comments)
+        for link, comment in self.thread.comments:
+            job.db_last_admin_id, job.db_last_admin_poster = comment.id, link.legacy_name[:255]
+            job.db_date_admin_update = comment.db_date_created
+            if not comment.db_is_private:
+                job.db_last_public_id, job.db_last_public_poster = comment.id, link.legacy_name[:255]
+                job.db_date_public_update = comment.db_date_created
+        self.jobs.append(job)
+        self.links.extend(links)
+        self.comments.extend(comment for link, comment in self.thread.comments)
+        self.thread = None
+
+    def write(self, resume_line):
+        """
+        Commits the queued jobs and saves a checkpoint that resumes at resume_line, or marks the
+        import done if that's None.
+        """
+        with transaction.atomic():
+            create_dated(JobDB, self.jobs)
+            JobLinkDB.objects.bulk_create(self.links)
+            create_dated(JobCommentDB, self.comments)
+        counts = self.state['counts']
+        counts['jobs'] += len(self.jobs)
+        counts['links'] += len(self.links)
+        counts['comments'] += len(self.comments)
+        self.jobs, self.links, self.comments = list(), list(), list()
+        if resume_line is None:
+            self.state['done'] = True
+        else:
+            self.state['line'] = resume_line
+        self.save_checkpoint()
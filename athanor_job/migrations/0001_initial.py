@@ -0,0 +1,143 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('typeclasses', '__first__'),
+        ('accounts', '__first__'),
+        ('objects', '__first__'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BucketDB',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('db_key', models.CharField(db_index=True, max_length=255, verbose_name='key')),
+                ('db_typeclass_path', models.CharField(db_index=True, max_length=255, null=True, verbose_name='typeclass')),
+                ('db_date_created', models.DateTimeField(auto_now_add=True, verbose_name='creation date')),
+                ('db_lock_storage', models.TextField(blank=True, verbose_name='locks')),
+                ('db_due', models.DurationField()),
+                ('db_description', models.TextField(blank=True, null=True)),
+                ('db_attributes', models.ManyToManyField(to='typeclasses.Attribute')),
+                ('db_tags', models.ManyToManyField(to='typeclasses.Tag')),
+            ],
+            options={
+                'verbose_name': 'Bucket',
+                'verbose_name_plural': 'Buckets',
+            },
+        ),
+        migrations.CreateModel(
+            name='JobDB',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('db_key', models.CharField(db_index=True, max_length=255, verbose_name='key')),
+                ('db_typeclass_path', models.CharField(db_index=True, max_length=255, null=True, verbose_name='typeclass')),
+                ('db_lock_storage', models.TextField(blank=True, verbose_name='locks')),
+                ('db_date_created', models.DateTimeField(auto_now_add=True, verbose_name='creation date')),
+                ('db_date_due', models.DateTimeField()),
+                ('db_date_closed', models.DateTimeField(null=True)),
+                ('db_status', models.SmallIntegerField(default=0)),
+                ('db_date_public_update', models.DateTimeField(null=True)),
+                ('db_date_admin_update', models.DateTimeField(null=True)),
+                ('db_owner_name', models.CharField(blank=True, default='', max_length=255)),
+                ('db_handler_names', models.CharField(blank=True, default='', max_length=255)),
+                ('db_helper_names', models.CharField(blank=True, default='', max_length=255)),
+                ('db_comment_count', models.PositiveIntegerField(default=0)),
+                ('db_last_public_poster', models.CharField(blank=True, default='', max_length=255)),
+                ('db_last_admin_poster', models.CharField(blank=True, default='', max_length=255)),
+                ('db_attributes', models.ManyToManyField(to='typeclasses.Attribute')),
+                ('db_tags', models.ManyToManyField(to='typeclasses.Tag')),
+                ('db_bucket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs',
+                                                to='athanor_job.BucketDB')),
+            ],
+            options={
+                'verbose_name': 'Job',
+                'verbose_name_plural': 'Jobs',
+            },
+        ),
+        migrations.CreateModel(
+            name='JobLinkDB',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('db_key', models.CharField(db_index=True, max_length=255, verbose_name='key')),
+                ('db_typeclass_path', models.CharField(db_index=True, max_length=255, null=True, verbose_name='typeclass')),
+                ('db_date_created', models.DateTimeField(auto_now_add=True, verbose_name='creation date')),
+                ('db_lock_storage', models.TextField(blank=True, verbose_name='locks')),
+                ('db_link_type', models.PositiveSmallIntegerField(default=0)),
+                ('db_date_checked', models.DateTimeField(null=True)),
+                ('db_attributes', models.ManyToManyField(to='typeclasses.Attribute')),
+                ('db_tags', models.ManyToManyField(to='typeclasses.Tag')),
+                ('db_account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='job_handling',
+                                                 to='accounts.AccountDB')),
+                ('db_character', models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT,
+                                                   related_name='job_handling', to='objects.ObjectDB')),
+                ('db_job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='links',
+                                             to='athanor_job.JobDB')),
+            ],
+            options={
+                'verbose_name': 'JobLink',
+                'verbose_name_plural': 'JobLinks',
+                'unique_together': {('db_account', 'db_character', 'db_job')},
+            },
+        ),
+        migrations.CreateModel(
+            name='JobCommentDB',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('db_key', models.CharField(db_index=True, max_length=255, verbose_name='key')),
+                ('db_typeclass_path', models.CharField(db_index=True, max_length=255, null=True, verbose_name='typeclass')),
+                ('db_lock_storage', models.TextField(blank=True, verbose_name='locks')),
+                ('db_date_created', models.DateTimeField(auto_now_add=True, verbose_name='creation date')),
+                ('db_text', models.TextField(blank=True, default=None, null=True)),
+                ('db_is_private', models.BooleanField(default=False)),
+                ('db_comment_mode', models.PositiveSmallIntegerField(default=1)),
+                ('db_attributes', models.ManyToManyField(to='typeclasses.Attribute')),
+                ('db_tags', models.ManyToManyField(to='typeclasses.Tag')),
+                ('db_link', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='comments',
+                                              to='athanor_job.JobLinkDB')),
+            ],
+            options={
+                'verbose_name': 'JobComment',
+                'verbose_name_plural': 'JobComments',
+            },
+        ),
+        migrations.AddField(
+            model_name='jobdb',
+            name='db_owner',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+',
+                                    to='athanor_job.JobLinkDB'),
+        ),
+        migrations.AddField(
+            model_name='jobdb',
+            name='db_last_public',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+',
+                                    to='athanor_job.JobCommentDB'),
+        ),
+        migrations.AddField(
+            model_name='jobdb',
+            name='db_last_admin',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+',
+                                    to='athanor_job.JobCommentDB'),
+        ),
+        migrations.CreateModel(
+            name='JobSearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('db_term', models.CharField(max_length=32)),
+                ('db_is_private', models.BooleanField(default=False)),
+                ('db_weight', models.PositiveIntegerField(default=1)),
+                ('db_job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms',
+                                             to='athanor_job.JobDB')),
+            ],
+            options={
+                'verbose_name': 'JobSearchTerm',
+                'verbose_name_plural': 'JobSearchTerms',
+                'unique_together': {('db_term', 'db_job', 'db_is_private')},
+            },
+        ),
+    ]
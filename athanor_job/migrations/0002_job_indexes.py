@@ -0,0 +1,43 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """
+    Indexes for the job system's hot access paths: bucket listings by status, closed-job age,
+    the pending due-date schedule, per-job link lookups and comment threads.
+    """
+
+    dependencies = [
+        ('athanor_job', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='jobdb',
+            index=models.Index(fields=['db_bucket', 'db_status', 'id'], name='job_bucket_status'),
+        ),
+        migrations.AddIndex(
+            model_name='jobdb',
+            index=models.Index(fields=['db_bucket', 'db_date_closed'], name='job_bucket_closed'),
+        ),
+        migrations.AddIndex(
+            model_name='jobdb',
+            index=models.Index(fields=['db_bucket', 'db_date_created'], name='job_bucket_created'),
+        ),
+        migrations.AddIndex(
+            model_name='jobdb',
+            index=models.Index(condition=models.Q(db_status=0), fields=['db_date_due'], name='job_pending_due'),
+        ),
+        migrations.AddIndex(
+            model_name='joblinkdb',
+            index=models.Index(fields=['db_job', 'db_link_type'], name='joblink_job_type'),
+        ),
+        migrations.AddIndex(
+            model_name='joblinkdb',
+            index=models.Index(fields=['db_account', 'db_job'], name='joblink_account_job'),
+        ),
+        migrations.AddIndex(
+            model_name='jobcommentdb',
+            index=models.Index(fields=['db_link', 'db_date_created'], name='jobcomment_link_created'),
+        ),
+    ]
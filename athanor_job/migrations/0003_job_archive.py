@@ -0,0 +1,55 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '__first__'),
+        ('athanor_job', '0002_job_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobArchiveDB',
+            fields=[
+                ('id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('db_bucket_name', models.CharField(max_length=255)),
+                ('db_title', models.CharField(max_length=255)),
+                ('db_status', models.SmallIntegerField()),
+                ('db_owner_name', models.CharField(blank=True, default='', max_length=255)),
+                ('db_handler_names', models.CharField(blank=True, default='', max_length=255)),
+                ('db_helper_names', models.CharField(blank=True, default='', max_length=255)),
+                ('db_comment_count', models.PositiveIntegerField(default=0)),
+                ('db_date_created', models.DateTimeField()),
+                ('db_date_due', models.DateTimeField()),
+                ('db_date_closed', models.DateTimeField(null=True)),
+                ('db_date_archived', models.DateTimeField()),
+                ('db_transcript', models.BinaryField()),
+                ('db_bucket', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL,
+                                                related_name='archived_jobs', to='athanor_job.BucketDB')),
+                ('db_owner', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL,
+                                               related_name='archived_jobs', to='accounts.AccountDB')),
+            ],
+            options={
+                'verbose_name': 'JobArchive',
+                'verbose_name_plural': 'JobArchives',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='jobarchivedb',
+            index=models.Index(fields=['db_bucket', 'db_date_closed'], name='jobarchive_bucket_closed'),
+        ),
+        migrations.AlterField(
+            model_name='jobsearchterm',
+            name='db_job',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE,
+                                    related_name='search_terms', to='athanor_job.JobDB'),
+        ),
+        migrations.AddField(
+            model_name='jobsearchterm',
+            name='db_archive',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE,
+                                    related_name='search_terms', to='athanor_job.JobArchiveDB'),
+        ),
+    ]
@@ -29,12 +29,26 @@ class JobDB(TypedObject):
     # Status: 0 = Pending. 1 = Approved. 2 = Denied. 3 = Canceled
     db_date_public_update = models.DateTimeField(null=True)
     db_date_admin_update = models.DateTimeField(null=True)
-
-
+    # Denormalized header data, kept current by DefaultJobLink.make_comment and DefaultJob.refresh_links.
+    db_owner = models.ForeignKey('JobLinkDB', related_name='+', null=True, on_delete=models.SET_NULL)
+    db_owner_name = models.CharField(max_length=255, blank=True, default='')
+    db_handler_names = models.CharField(max_length=255, blank=True, default='')
+    db_helper_names = models.CharField(max_length=255, blank=True, default='')
+    db_comment_count = models.PositiveIntegerField(default=0)
+    db_last_public = models.ForeignKey('JobCommentDB', related_name='+', null=True, on_delete=models.SET_NULL)
+    db_last_public_poster = models.CharField(max_length=255, blank=True, default='')
+    db_last_admin = models.ForeignKey('JobCommentDB', related_name='+', null=True, on_delete=models.SET_NULL)
+    db_last_admin_poster = models.CharField(max_length=255, blank=True, default='')
 
     class Meta:
         verbose_name = 'Job'
         verbose_name_plural = 'Jobs'
+        indexes = [
+            models.Index(fields=['db_bucket', 'db_status', 'id'], name='job_bucket_status'),
+            models.Index(fields=['db_bucket', 'db_date_closed'], name='job_bucket_closed'),
+            models.Index(fields=['db_bucket', 'db_date_created'], name='job_bucket_created'),
+            models.Index(fields=['db_date_due'], name='job_pending_due', condition=models.Q(db_status=0)),
+        ]
 
 
 class JobLinkDB(TypedObject):
@@ -43,7 +57,8 @@ class JobLinkDB(TypedObject):
     __applabel__ = "jobs"
 
     db_account = models.ForeignKey('accounts.AccountDB', related_name='job_handling', on_delete=models.PROTECT)
-    db_character = models.ForeignKey('objects.ObjectDB', related_name='job_handling', on_delete=models.PROTECT)
+    db_character = models.ForeignKey('objects.ObjectDB', related_name='job_handling', null=True,
+                                     on_delete=models.PROTECT)
     db_job = models.ForeignKey(JobDB, related_name='links', on_delete=models.CASCADE)
     db_link_type = models.PositiveSmallIntegerField(default=0)
     db_date_checked = models.DateTimeField(null=True)
@@ -52,6 +67,10 @@ class JobLinkDB(TypedObject):
         verbose_name = 'JobLink'
         verbose_name_plural = 'JobLinks'
         unique_together = (("db_account", "db_character", "db_job"),)
+        indexes = [
+            models.Index(fields=['db_job', 'db_link_type'], name='joblink_job_type'),
+            models.Index(fields=['db_account', 'db_job'], name='joblink_account_job'),
+        ]
 
 
 
@@ -73,5 +92,55 @@ class JobCommentDB(TypedObject):
     class Meta:
         verbose_name = 'JobComment'
         verbose_name_plural = 'JobComments'
+        indexes = [
+            models.Index(fields=['db_link', 'db_date_created'], name='jobcomment_link_created'),
+        ]
+
+
+class JobSearchTerm(models.Model):
+    """
+    Inverted index over job titles and comment text. One row per (term, job, privacy) with the number
+    of times the term appears, so a search is an indexed lookup on db_term.
+    """
+    db_term = models.CharField(max_length=32)
+    db_job = models.ForeignKey(JobDB, related_name='search_terms', null=True, on_delete=models.CASCADE)
+    # Set instead of db_job once the job is archived. An archive's id is the original job id.
+    db_archive = models.ForeignKey('JobArchiveDB', related_name='search_terms', null=True, on_delete=models.CASCADE)
+    db_is_private = models.BooleanField(default=False)
+    db_weight = models.PositiveIntegerField(default=1)
 
+    class Meta:
+        verbose_name = 'JobSearchTerm'
+        verbose_name_plural = 'JobSearchTerms'
+        unique_together = (("db_term", "db_job", "db_is_private"),)
+
+
+class JobArchiveDB(models.Model):
+    """
+    Compact cold-storage copy of a long-closed job. Its links and comments are kept as a single
+    zlib-compressed JSON transcript rather than as rows. The primary key is the original job id, so
+    +job <id> keeps working after archival.
+    """
+    id = models.PositiveIntegerField(primary_key=True)
+    db_bucket = models.ForeignKey(BucketDB, related_name='archived_jobs', null=True, on_delete=models.SET_NULL)
+    db_bucket_name = models.CharField(max_length=255)
+    db_title = models.CharField(max_length=255)
+    db_status = models.SmallIntegerField()
+    db_owner = models.ForeignKey('accounts.AccountDB', related_name='archived_jobs', null=True,
+                                 on_delete=models.SET_NULL)
+    db_owner_name = models.CharField(max_length=255, blank=True, default='')
+    db_handler_names = models.CharField(max_length=255, blank=True, default='')
+    db_helper_names = models.CharField(max_length=255, blank=True, default='')
+    db_comment_count = models.PositiveIntegerField(default=0)
+    db_date_created = models.DateTimeField()
+    db_date_due = models.DateTimeField()
+    db_date_closed = models.DateTimeField(null=True)
+    db_date_archived = models.DateTimeField()
+    db_transcript = models.BinaryField()
 
+    class Meta:
+        verbose_name = 'JobArchive'
+        verbose_name_plural = 'JobArchives'
+        indexes = [
+            models.Index(fields=['db_bucket', 'db_date_closed'], name='jobarchive_bucket_closed'),
+        ]
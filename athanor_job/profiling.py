@@ -0,0 +1,168 @@
+import time
+from bisect import bisect_left
+from collections import deque
+from functools import wraps
+from django.db import connections
+
+# Upper edges, in milliseconds, of the latency histogram buckets. The last bucket is open-ended.
+HISTOGRAM_EDGES = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+class QueryMeter:
+    """
+    Counts the queries run on the database connections, and the time spent in them, for the
+    duration of a with-block. Works regardless of settings.DEBUG. Every alias is metered unless
+    using names one, so reads sent to a replica count too.
+    """
+
+    def __init__(self, using=None):
+        self.using = using
+        self.queries = 0
+        self.db_time = 0.0
+        self.wall_time = 0.0
+        self._wrappers = list()
+        self._started = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - start
+
+    def __enter__(self):
+        aliases = [self.using] if self.using else list(connections)
+        self._wrappers = [connections[alias].execute_wrapper(self) for alias in aliases]
+        for wrapper in self._wrappers:
+            wrapper.__enter__()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.wall_time = time.perf_counter() - self._started
+        for wrapper in reversed(self._wrappers):
+            wrapper.__exit__(exc_type, exc_val, exc_tb)
+        self._wrappers = list()
+
+    def as_dict(self):
+        return {'queries': self.queries, 'db_time': self.db_time, 'wall_time': self.wall_time}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(int(round(pct / 100.0 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+class LatencyHistogram:
+    """
+    Rolling latency record for one operation: the most recent window samples, plus a lifetime count.
+    """
+
+    def __init__(self, window=1000):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+
+    def add(self, seconds):
+        self.samples.append(seconds * 1000)
+        self.count += 1
+
+    def histogram(self):
+        counts = [0] * (len(HISTOGRAM_EDGES) + 1)
+        for ms in self.samples:
+            counts[bisect_left(HISTOGRAM_EDGES, ms)] += 1
+        labels = [f"<={edge}ms" for edge in HISTOGRAM_EDGES] + [f">{HISTOGRAM_EDGES[-1]}ms"]
+        return dict(zip(labels, counts))
+
+    def summary(self):
+        samples = list(self.samples)
+        return {'count': self.count, 'p50_ms': percentile(samples, 50), 'p90_ms': percentile(samples, 90),
+                'p99_ms': percentile(samples, 99), 'max_ms': max(samples) if samples else 0.0,
+                'histogram': self.histogram()}
+
+
+TIMINGS = dict()
+
+
+def record(name, seconds):
+    if name not in TIMINGS:
+        TIMINGS[name] = LatencyHistogram()
+    TIMINGS[name].add(seconds)
+
+
+def timed(name):
+    """
+    Decorator recording every call's latency under name, whether or not it raises.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def timing_summary():
+    return {name: hist.summary() for name, hist in sorted(TIMINGS.items())}
+
+
+class _Capture:
+    def __init__(self):
+        self.messages = list()
+
+    def __call__(self, text=None, **kwargs):
+        self.messages.append(text)
+
+
+def command(cmdclass, account, args='', switches=()):
+    """
+    Builds a job command as if account had typed it, with its output captured instead of sent.
+    """
+    cmd = cmdclass()
+    cmd.caller = cmd.account = account
+    cmd.session = None
+    cmd.args = args
+    cmd.switches = list(switches)
+    lhs, _, rhs = args.partition('=')
+    cmd.lhs, cmd.rhs = lhs.strip(), (rhs.strip() or None)
+    cmd.msg = _Capture()
+    return cmd
+
+
+def assert_query_budget(cmdclass, account, args='', switches=(), budget=None):
+    """
+    Runs a job command and fails if it issued more queries than its budget. The budget defaults
+    to the command's own query_budgets entry for the switch.
+
+    Returns:
+        QueryMeter for the run.
+    """
+    cmd = command(cmdclass, account, args, switches)
+    cmd.run_metered()
+    if budget is None:
+        budget = cmd.query_budget()
+    stats = cmd.query_stats
+    if budget is not None and stats.queries > budget:
+        raise AssertionError(f"{cmdclass.key} {'/'.join(switches)} {args} ran {stats.queries} queries; "
+                             f"budget is {budget}.")
+    return stats
+
+
+def assert_job_budgets(account, bucket, job):
+    """
+    Checks the budgets of +jlist <bucket>, +job <id>, +jbucket and +jlist/scan.
+    """
+    from athanor.jobs.commands import CmdJobList, CmdJob, CmdJBucket
+    return {
+        '+jlist': assert_query_budget(CmdJobList, account, bucket.key),
+        '+job': assert_query_budget(CmdJob, account, str(job.id)),
+        '+jbucket': assert_query_budget(CmdJBucket, account),
+        '+jlist/scan': assert_query_budget(CmdJobList, account, switches=['scan']),
+    }
@@ -0,0 +1,113 @@
+"""
+Lightweight read-only views of job rows for listings and thread rendering.
+
+Each projection is a __slots__ record filled straight from values_list(), so a page of rows costs
+no typeclass, attribute, tag or lock handler construction. Fetch full typeclass instances only
+when something is going to be changed.
+"""
+from evennia.utils.ansi import ANSIString
+from evennia.utils.utils import time_format
+from athanor.utils.time import utcnow
+
+COMMENT_MODES = {0: 'Opened', 1: 'Replied', 2: '|rSTAFF COMMENTED|n', 3: 'Moved', 4: 'Approved',
+                 5: 'Denied', 6: 'Canceled', 7: 'Revived', 8: 'Appointed Handler', 9: 'Appointed Helper',
+                 10: 'Removed Handler', 11: 'Removed Helper', 12: 'Due Date Changed'}
+
+# Comment modes shown inline after the header instead of as a paragraph.
+INLINE_MODES = (3, 8, 9, 10, 11, 12)
+
+STATUS_LETTERS = {0: 'P', 1: 'A', 2: 'D', 3: 'C'}
+
+
+class Projection:
+    __slots__ = ()
+    # Query lookups, in the same order as __slots__.
+    fields = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    @classmethod
+    def fetch(cls, queryset):
+        return [cls(*row) for row in queryset.values_list(*cls.fields)]
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.id}>"
+
+
+class JobRow(Projection):
+    __slots__ = ('id', 'db_key', 'db_bucket_id', 'db_status', 'db_date_created', 'db_date_due', 'db_date_closed',
+                 'db_date_public_update', 'db_date_admin_update', 'db_owner_name', 'db_handler_names',
+                 'db_helper_names', 'db_comment_count')
+    fields = ('id', 'db_key', 'db_bucket', 'db_status', 'db_date_created', 'db_date_due', 'db_date_closed',
+              'db_date_public_update', 'db_date_admin_update', 'db_owner_name', 'db_handler_names',
+              'db_helper_names', 'db_comment_count')
+
+    @property
+    def title(self):
+        return self.db_key
+
+
+class LinkRow(Projection):
+    __slots__ = ('id', 'db_job_id', 'db_account_id', 'account_name', 'db_link_type', 'db_date_checked')
+    fields = ('id', 'db_job', 'db_account', 'db_account__db_key', 'db_link_type', 'db_date_checked')
+
+    def __str__(self):
+        return self.account_name
+
+
+class CommentRow(Projection):
+    __slots__ = ('id', 'db_date_created', 'db_text', 'db_is_private', 'db_comment_mode', 'poster', 'link_type')
+    fields = ('id', 'db_date_created', 'db_text', 'db_is_private', 'db_comment_mode', 'db_link__db_account__db_key',
+              'db_link__db_link_type')
+
+    def display(self, viewer, admin=False):
+        return format_comment(self.poster, self.db_comment_mode, self.db_date_created, self.db_text, viewer)
+
+
+def job_line_static(job):
+    """
+    The parts of a job's listing row that only change when the job does: status, id, owner, title
+    and handlers. Safe to cache against the job's version.
+    """
+    num = str(job.id).rjust(4).ljust(5)
+    owner = job.db_owner_name[:15].ljust(16)
+    title = job.db_key[:29].ljust(30)
+    claimed = job.db_handler_names[:12].ljust(13)
+    return f"{STATUS_LETTERS[job.db_status]} {num}{owner}{title}{claimed}"
+
+
+def format_job_line(job, admin, linked=False, checked=None, static=None):
+    """
+    A job's listing row. Works on DefaultJob instances and JobRows alike. The unread star, due
+    countdown and last-update age are always worked out fresh; pass static to reuse a cached
+    job_line_static().
+    """
+    public_update = job.db_date_public_update or job.db_date_created
+    last_update = public_update
+    if admin and job.db_date_admin_update:
+        last_update = max(job.db_date_admin_update, public_update)
+    unread = not linked or not checked or last_update > checked
+    star = ANSIString('|r*|n') if unread else ' '
+    if static is None:
+        static = job_line_static(job)
+    now = utcnow().timestamp()
+    due = job.db_date_due.timestamp() - now
+    if due <= 0:
+        due = ANSIString("|rOVER|n")
+    else:
+        due = time_format(due, 1)
+    due = due.rjust(6).ljust(7)
+    last = time_format(now - last_update.timestamp(), 1).rjust(4)
+    return f"{star}{static}{due}{last}"
+
+
+def format_comment(poster, mode, date, text, viewer):
+    show_date = viewer.display_time(time_disp=date)
+    message = f"{poster} |w{COMMENT_MODES.get(mode, 'Unknown')} on {show_date}:|n"
+    if mode in INLINE_MODES:
+        message += " %s" % text
+    else:
+        message += "\n\n%s" % text
+    return message
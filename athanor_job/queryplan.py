@@ -0,0 +1,83 @@
+"""
+Query-plan regression checks for the job system's hot queries.
+
+Run check_plans() against a populated database (SQLite or PostgreSQL) from a game's test suite or
+`evennia shell`. It EXPLAINs every listing query and reports any that read a job table with a
+sequential scan instead of one of the indexes from migration 0002.
+"""
+import re
+from django.db import connection
+from django.db.models import Count
+from athanor.jobs.models import JobDB
+from athanor.utils.time import utcnow
+
+_RE_SQLITE_SCAN = re.compile(r"\bSCAN (?:TABLE )?(athanor_job_\w+)\b(?! USING)")
+_RE_POSTGRES_SCAN = re.compile(r"\bSeq Scan on (athanor_job_\w+)")
+
+
+def hot_queries(bucket, viewer):
+    """
+    The querysets behind +jlist, +jlist/old, +jlist/pending, +jlist/scan and +jbucket.
+
+    Args:
+        bucket (DefaultBucket): Bucket to run the per-bucket listings against.
+        viewer (AccountDB): Account to run the unread query for.
+
+    Returns:
+        dict of name: QuerySet
+    """
+    return {
+        'active': bucket.active(),
+        'pending': bucket.pending(),
+        'old': bucket.old(),
+        'new': bucket.new(viewer),
+        'bucket_status_counts': JobDB.objects.filter(db_bucket=bucket).values('db_bucket', 'db_status')
+            .annotate(total=Count('id')),
+        'bucket_overdue': JobDB.objects.filter(db_bucket=bucket, db_status=0, db_date_due__lt=utcnow())
+            .values('db_bucket').annotate(total=Count('id')),
+        'pending_due': JobDB.objects.filter(db_status=0, db_date_due__gt=utcnow()).values_list('id', 'db_date_due'),
+    }
+
+
+def sequential_scans(plan):
+    """
+    The job tables a query plan reads without an index.
+    """
+    pattern = _RE_POSTGRES_SCAN if connection.vendor == 'postgresql' else _RE_SQLITE_SCAN
+    return sorted(set(pattern.findall(plan)))
+
+
+def explain(queryset):
+    if connection.vendor != 'postgresql':
+        return queryset.explain()
+    # Small tables make the planner prefer sequential scans regardless of indexes, so ask it
+    # whether an index path exists at all.
+    with connection.cursor() as cursor:
+        cursor.execute("SET enable_seqscan = off")
+        try:
+            return queryset.explain()
+        finally:
+            cursor.execute("SET enable_seqscan = on")
+
+
+def check_plans(bucket, viewer):
+    """
+    EXPLAINs every hot query.
+
+    Returns:
+        dict of name: (scanned tables, plan) for each query that fell back to a sequential scan.
+    """
+    failures = dict()
+    for name, queryset in hot_queries(bucket, viewer).items():
+        plan = explain(queryset)
+        scans = sequential_scans(plan)
+        if scans:
+            failures[name] = (scans, plan)
+    return failures
+
+
+def assert_indexed(bucket, viewer):
+    failures = check_plans(bucket, viewer)
+    if failures:
+        raise AssertionError('\n\n'.join(f"{name} scans {', '.join(scans)}:\n{plan}"
+                                         for name, (scans, plan) in failures.items()))
@@ -0,0 +1,60 @@
+"""
+Retention policies and chunked job deletion.
+
+A Bucket's policy is kept in its 'retention' Attribute as (action, seconds): 'purge' deletes jobs
+closed longer than that, 'archive' moves them into the archive tier. JobManager.retention_tick()
+applies the policies, and drains Buckets queued for deletion, a batch at a time.
+
+delete_jobs() deletes children before parents, one table per statement, so no single statement
+cascades through a whole Bucket's history.
+"""
+import datetime
+from django.db import transaction
+from athanor.jobs.models import JobDB, JobLinkDB, JobCommentDB, JobSearchTerm
+
+ACTIONS = ('purge', 'archive')
+
+
+def get_policy(bucket):
+    """
+    The Bucket's retention policy as (action, timedelta), or None.
+    """
+    policy = bucket.attributes.get('retention')
+    if not policy:
+        return None
+    action, seconds = policy
+    return action, datetime.timedelta(seconds=seconds)
+
+
+def set_policy(bucket, action=None, age=None):
+    if not action:
+        bucket.attributes.remove('retention')
+        return
+    if action not in ACTIONS:
+        raise ValueError(f"Retention must be one of: {', '.join(ACTIONS)}, or none.")
+    if age is None or age.total_seconds() <= 0:
+        raise ValueError("Retention needs a positive age!")
+    bucket.attributes.add('retention', (action, int(age.total_seconds())))
+
+
+def expired(bucket, older_than):
+    """
+    Closed jobs in bucket that were closed before older_than.
+    """
+    return JobDB.objects.filter(db_bucket=bucket, db_date_closed__lt=older_than).exclude(db_status=0)
+
+
+def delete_jobs(job_ids):
+    """
+    Deletes jobs along with their search terms, comments and links, in one transaction.
+    """
+    if not job_ids:
+        return 0
+    with transaction.atomic():
+        # Clear the header pointers first so deleting comments and links doesn't have to null them.
+        JobDB.objects.filter(id__in=job_ids).update(db_owner=None, db_last_public=None, db_last_admin=None)
+        JobSearchTerm.objects.filter(db_job_id__in=job_ids).delete()
+        JobCommentDB.objects.filter(db_link__db_job_id__in=job_ids).delete()
+        JobLinkDB.objects.filter(db_job_id__in=job_ids).delete()
+        JobDB.objects.filter(id__in=job_ids).delete()
+    return len(job_ids)
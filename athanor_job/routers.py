@@ -0,0 +1,126 @@
+"""
+Read-replica routing for the job system's listing paths.
+
+Set JOB_READ_DATABASE to a DATABASES alias and the job commands' read-only views (bucket lists and
+counts, bucket listings, job transcripts) read job tables from it. Every write, and every other read,
+stays on the primary. An account that has just written to the job tables keeps reading from the
+primary for JOB_READ_STICKY seconds, so it always sees its own changes even while the replica lags
+behind. The router sees every write, so no write path can skip this.
+
+Trying it out locally with a second SQLite file as the replica:
+
+    # server/conf/settings.py
+    DATABASES['replica'] = {'ENGINE': 'django.db.backends.sqlite3',
+                            'NAME': os.path.join(GAME_DIR, 'server', 'replica.db3')}
+    JOB_READ_DATABASE = 'replica'
+
+then copy server/evennia.db3 to server/replica.db3 whenever the "replica" should catch up. Jobs
+posted after the copy stay invisible in listings, apart from their poster's own sticky window, until
+the next copy. The router never migrates the replica alias; it's meant to be a copy of the primary.
+
+Job and Bucket instances are cached by the idmapper for the server's lifetime, so code that loads them
+inside a reading() block should do it under primary(); listings read projections and aggregates.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from athanor.jobs.models import JobDB
+
+_LOCAL = threading.local()
+
+# account id (None for writes no account made): monotonic time reads may go back to the replica.
+_STICKY = dict()
+
+
+def read_alias():
+    alias = getattr(settings, 'JOB_READ_DATABASE', None)
+    if not alias or alias not in settings.DATABASES:
+        return None
+    return alias
+
+
+def wrote(account_id=None):
+    """
+    Pins an account's reads to the primary for JOB_READ_STICKY seconds. JobReadRouter calls this for
+    every job-table write, with the account set by acting(). Writes made outside any account's
+    command, like the retention tick or imports, pin everyone's reads.
+    """
+    if read_alias():
+        _STICKY[account_id] = time.monotonic() + getattr(settings, 'JOB_READ_STICKY', 10)
+
+
+def is_sticky(account_id):
+    now = time.monotonic()
+    for key in (None, account_id):
+        until = _STICKY.get(key)
+        if until is None:
+            continue
+        if until >= now:
+            return True
+        _STICKY.pop(key, None)
+    return False
+
+
+@contextmanager
+def acting(account):
+    """
+    Attributes job-table writes inside the block to account, for read-your-writes stickiness.
+    """
+    previous = getattr(_LOCAL, 'account_id', None)
+    _LOCAL.account_id = account.id if account is not None else None
+    try:
+        yield
+    finally:
+        _LOCAL.account_id = previous
+
+
+@contextmanager
+def reading(account):
+    """
+    Lets job-table reads inside the block go to the replica, unless account has written recently.
+    """
+    previous = getattr(_LOCAL, 'replica', False)
+    _LOCAL.replica = account is None or not is_sticky(account.id)
+    try:
+        yield
+    finally:
+        _LOCAL.replica = previous
+
+
+@contextmanager
+def primary():
+    """
+    Keeps reads inside the block on the primary, for loads that seed long-lived caches.
+    """
+    previous = getattr(_LOCAL, 'replica', False)
+    _LOCAL.replica = False
+    try:
+        yield
+    finally:
+        _LOCAL.replica = previous
+
+
+class JobReadRouter:
+
+    def db_for_read(self, model, **hints):
+        if not getattr(_LOCAL, 'replica', False) or model._meta.app_label != JobDB._meta.app_label:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return read_alias()
+
+    def db_for_write(self, model, **hints):
+        # Every save, bulk write, update and delete on a job table comes through here.
+        if model._meta.app_label == JobDB._meta.app_label:
+            wrote(getattr(_LOCAL, 'account_id', None))
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == read_alias():
+            return False
+        return None
@@ -0,0 +1,128 @@
+import re
+from collections import Counter
+from django.db import transaction
+from django.db.models import Count, Sum, Q
+from django.db.models.functions import Coalesce
+from evennia.utils.ansi import strip_ansi
+from athanor.jobs.models import JobDB, JobLinkDB, JobCommentDB, JobSearchTerm
+
+_RE_TERM = re.compile(r"[a-z0-9][a-z0-9']{1,31}")
+
+_STOP_WORDS = {'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'has', 'have', 'in', 'is', 'it', 'its',
+               'of', 'on', 'or', 'that', 'the', 'this', 'to', 'was', 'were', 'will', 'with'}
+
+# A term in a job's title counts this many times over one in its comments.
+TITLE_WEIGHT = 5
+
+
+def tokenize(text):
+    if not text:
+        return Counter()
+    return Counter(term.strip("'") for term in _RE_TERM.findall(strip_ansi(text).lower())
+                   if term.strip("'") not in _STOP_WORDS)
+
+
+def index_many(entries):
+    """
+    Adds terms to many jobs' index entries with one read, one bulk update and one bulk insert.
+
+    Args:
+        entries (dict): {(job_id, private): Counter of terms}
+    """
+    entries = {key: terms for key, terms in entries.items() if terms}
+    if not entries:
+        return
+    all_terms = set()
+    for terms in entries.values():
+        all_terms.update(terms.keys())
+    existing = {(row.db_job_id, row.db_is_private, row.db_term): row for row in
+                JobSearchTerm.objects.filter(db_job_id__in={job_id for job_id, private in entries},
+                                             db_term__in=all_terms)}
+    updated, created = list(), list()
+    for (job_id, private), terms in entries.items():
+        for term, weight in terms.items():
+            row = existing.get((job_id, private, term))
+            if row:
+                row.db_weight += weight
+                updated.append(row)
+            else:
+                created.append(JobSearchTerm(db_term=term, db_job_id=job_id, db_is_private=private, db_weight=weight))
+    JobSearchTerm.objects.bulk_update(updated, ['db_weight'])
+    JobSearchTerm.objects.bulk_create(created)
+
+
+def comment_terms(comment, job):
+    terms = tokenize(comment.db_text)
+    if comment.db_comment_mode == 0:
+        for term, weight in tokenize(job.db_key).items():
+            terms[term] += weight * TITLE_WEIGHT
+    return terms
+
+
+def index_comments(pairs):
+    """
+    Indexes the text of (comment, job) pairs, and the job's title along with its opening comment.
+    """
+    entries = dict()
+    for comment, job in pairs:
+        entries.setdefault((job.id, comment.db_is_private), Counter()).update(comment_terms(comment, job))
+    index_many(entries)
+
+
+def rebuild(chunk_size=2000):
+    """
+    Rebuilds the whole index from the job and comment tables, streaming rows in job order so only
+    one job's terms are held in memory at a time. Archived jobs keep their existing terms. It all
+    happens in one transaction, so searches see the old index until the new one is complete, and a
+    failure part-way leaves the old index in place.
+    """
+    with transaction.atomic():
+        JobSearchTerm.objects.filter(db_archive=None).delete()
+        titles = JobDB.objects.order_by('id').values_list('id', 'db_key').iterator(chunk_size=chunk_size)
+        comments = JobCommentDB.objects.order_by('db_link__db_job', 'id')\
+            .values_list('db_link__db_job', 'db_text', 'db_is_private').iterator(chunk_size=chunk_size)
+        batch = list()
+        comment = next(comments, None)
+        for job_id, title in titles:
+            found = {False: Counter({term: weight * TITLE_WEIGHT for term, weight in tokenize(title).items()}),
+                     True: Counter()}
+            while comment and comment[0] <= job_id:
+                if comment[0] == job_id:
+                    found[comment[2]].update(tokenize(comment[1]))
+                comment = next(comments, None)
+            for private, terms in found.items():
+                batch.extend(JobSearchTerm(db_term=term, db_job_id=job_id, db_is_private=private, db_weight=weight)
+                             for term, weight in terms.items())
+            if len(batch) >= chunk_size:
+                JobSearchTerm.objects.bulk_create(batch)
+                batch = list()
+        JobSearchTerm.objects.bulk_create(batch)
+
+
+def search(text, admin_buckets=(), account=None, limit=30):
+    """
+    Ranked search over the index.
+
+    Args:
+        text (str): The search terms. Jobs matching more distinct terms rank higher, then by weight.
+        admin_buckets (iterable): Bucket ids whose jobs may be searched in full, private comments included.
+        account (AccountDB): If given, also search the public text of jobs this account is linked to
+            and of archived jobs it owned.
+        limit (int): Maximum results.
+
+    Returns:
+        list of job ids, best match first. Archived jobs keep their original ids.
+    """
+    terms = list(tokenize(text).keys())
+    if not terms:
+        return list()
+    admin_buckets = list(admin_buckets)
+    allowed = Q(db_job__db_bucket_id__in=admin_buckets) | Q(db_archive__db_bucket_id__in=admin_buckets)
+    if account is not None:
+        linked = JobLinkDB.objects.filter(db_account=account, db_link_type__gt=0).values('db_job')
+        allowed |= Q(db_job_id__in=linked, db_is_private=False)
+        allowed |= Q(db_archive__db_owner=account, db_is_private=False)
+    ranked = JobSearchTerm.objects.filter(allowed, db_term__in=terms).annotate(job=Coalesce('db_job', 'db_archive'))\
+        .values('job').annotate(matched=Count('db_term', distinct=True), score=Sum('db_weight'))\
+        .order_by('-matched', '-score', '-job')
+    return [row['job'] for row in ranked[:limit]]
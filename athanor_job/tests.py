@@ -0,0 +1,231 @@
+import io
+import os
+import datetime
+import tempfile
+from unittest import mock
+from django.db import DatabaseError
+from django.test import TestCase
+from twisted.python import threadable
+from evennia.accounts.models import AccountDB
+from evennia.utils.create import create_script
+from evennia.utils.test_resources import EvenniaTest
+from athanor.jobs import benchmark, queryplan, transfer, legacy, profiling
+from athanor.jobs.controllers import JobManager
+from athanor.jobs.models import BucketDB, JobDB, JobLinkDB, JobCommentDB
+from athanor.utils.time import utcnow
+
+
+class TestQueryPlans(TestCase):
+
+    def setUp(self):
+        ids = benchmark.generate({'buckets': 2, 'jobs': 200, 'comments': 600, 'accounts': 5})
+        self.bucket = BucketDB.objects.get(id=ids['buckets'][0])
+        self.viewer = AccountDB.objects.get(id=ids['accounts'][0])
+
+    def test_hot_queries_use_indexes(self):
+        queryplan.assert_indexed(self.bucket, self.viewer)
+
+
+class JobTestCase(EvenniaTest):
+    """
+    Runs with a JobManager as GLOBAL_SCRIPTS.jobs, self.account as a superuser and one Bucket.
+    """
+
+    def setUp(self):
+        super().setUp()
+        # The test thread stands in for the reactor, so the JobManager's caches update in place.
+        threadable.registerAsIOThread()
+        self.account.is_superuser = True
+        self.account.save()
+        self.jobs = create_script(JobManager, key='jobs', persistent=True)
+        self.bucket = self.jobs.create_bucket(self.account, 'Tests')
+
+    def tearDown(self):
+        self.jobs.delete()
+        super().tearDown()
+
+    def make_jobs(self, count):
+        return self.jobs.create_jobs(self.account, self.bucket,
+                                     [(f"Request {n}", f"Opening text {n}.") for n in range(count)])
+
+    def header(self, job_id):
+        return JobDB.objects.filter(id=job_id).values('db_status', 'db_date_closed', 'db_comment_count',
+                                                      'db_last_admin', 'db_last_public', 'db_last_admin_poster',
+                                                      'db_last_public_poster').get()
+
+
+class TestStatusChanges(JobTestCase):
+
+    def test_bulk_approve(self):
+        job_ids = [job.id for job in self.make_jobs(3)]
+        self.assertEqual(self.jobs.count_listing(self.bucket, 'pending'), 3)
+        self.jobs.change_jobs_status(self.account, job_ids, 1)
+        for job_id in job_ids:
+            header = self.header(job_id)
+            self.assertEqual(header['db_status'], 1)
+            self.assertIsNotNone(header['db_date_closed'])
+            self.assertEqual(header['db_comment_count'], 2)
+            self.assertEqual(header['db_last_admin'], header['db_last_public'])
+            self.assertEqual(header['db_last_admin_poster'], str(self.account))
+            comment = JobCommentDB.objects.filter(id=header['db_last_admin'])\
+                .values('db_comment_mode', 'db_text', 'db_link__db_job').get()
+            self.assertEqual(comment['db_comment_mode'], 4)
+            self.assertEqual(comment['db_text'], f"{self.account} approved the job.")
+            self.assertEqual(comment['db_link__db_job'], job_id)
+            self.assertNotIn(job_id, self.jobs.ndb.due_index)
+        self.assertEqual(self.jobs.count_listing(self.bucket, 'pending'), 0)
+        self.assertEqual(self.jobs.count_listing(self.bucket, 'old'), 3)
+        with self.assertRaises(ValueError):
+            self.jobs.change_jobs_status(self.account, job_ids, 1)
+
+    def test_revive(self):
+        job_ids = [job.id for job in self.make_jobs(2)]
+        self.jobs.status_counts()
+        self.jobs.change_jobs_status(self.account, job_ids, 3)
+        self.jobs.change_jobs_status(self.account, job_ids[:1], 0, text="Reopening this one.")
+        header = self.header(job_ids[0])
+        self.assertEqual(header['db_status'], 0)
+        self.assertIsNone(header['db_date_closed'])
+        self.assertEqual(header['db_comment_count'], 3)
+        comment = JobCommentDB.objects.filter(id=header['db_last_public']).values('db_comment_mode', 'db_text').get()
+        self.assertEqual(comment, {'db_comment_mode': 7, 'db_text': "Reopening this one."})
+        self.assertIn(job_ids[0], self.jobs.ndb.due_index)
+        self.assertEqual(self.header(job_ids[1])['db_status'], 3)
+        # The counts kept up to date since before the changes must match a fresh count.
+        cached = dict(self.jobs.status_counts()[self.bucket.id])
+        self.jobs.clear_counts()
+        self.assertEqual({k: v for k, v in cached.items() if v},
+                         {k: v for k, v in self.jobs.status_counts()[self.bucket.id].items() if v})
+        # The owner made the change, so the status comment goes on the owner's link.
+        self.assertEqual(JobDB.objects.get(id=job_ids[0]).links.count(), 1)
+
+
+class TestReadReceipts(JobTestCase):
+
+    def checked(self, account, job):
+        return JobLinkDB.objects.filter(db_account=account, db_job=job).values_list('db_date_checked', 'db_link_type')
+
+    def test_flush(self):
+        job = self.make_jobs(1)[0]
+        self.jobs.mark_read(self.account, job)
+        self.jobs.mark_read(self.account2, job)
+        receipts = dict(self.jobs.ndb.read_receipts)
+        self.jobs.flush_receipts()
+        self.assertFalse(self.jobs.ndb.read_receipts)
+        # The owner's link is updated in place; the other account gets a new, plain link.
+        self.assertEqual(list(self.checked(self.account, job)), [(receipts[(self.account.id, job.id)], 3)])
+        self.assertEqual(list(self.checked(self.account2, job)), [(receipts[(self.account2.id, job.id)], 0)])
+
+    def test_failed_flush_keeps_receipts(self):
+        job = self.make_jobs(1)[0]
+        self.jobs.mark_read(self.account2, job)
+        with mock.patch.object(JobLinkDB.objects, 'bulk_create', side_effect=DatabaseError("write failed")):
+            with self.assertRaises(DatabaseError):
+                self.jobs.flush_receipts()
+        self.assertIn((self.account2.id, job.id), self.jobs.ndb.read_receipts)
+        self.assertFalse(self.checked(self.account2, job).exists())
+        self.jobs.flush_receipts()
+        self.assertTrue(self.checked(self.account2, job).exists())
+
+
+class TestTransfer(JobTestCase):
+
+    def last_id(self, model):
+        return model.objects.order_by('-id').values_list('id', flat=True).first()
+
+    def test_export_then_import(self):
+        job_ids = [job.id for job in self.make_jobs(2)]
+        created = utcnow().replace(microsecond=0) - datetime.timedelta(days=400)
+        JobDB.objects.filter(id__in=job_ids).update(db_date_created=created)
+        JobCommentDB.objects.filter(db_link__db_job_id__in=job_ids).update(db_date_created=created)
+        stream = io.StringIO()
+        exported = transfer.export(stream)
+        self.assertEqual((exported['bucket'], exported['job'], exported['comment']), (1, 2, 2))
+
+        job_offset, link_offset, comment_offset = (self.last_id(JobDB), self.last_id(JobLinkDB),
+                                                   self.last_id(JobCommentDB))
+        fields = ('db_key', 'db_bucket', 'db_date_created', 'db_owner', 'db_last_admin', 'db_last_public')
+        before = {row['id']: row for row in JobDB.objects.filter(id__in=job_ids).values('id', *fields)}
+        counts = transfer.load(io.StringIO(stream.getvalue()), self.account)
+        self.assertEqual(counts['job'], 2)
+        for job_id, old in before.items():
+            new = JobDB.objects.filter(id=job_id + job_offset).values(*fields).get()
+            self.assertEqual(new['db_key'], old['db_key'])
+            # Buckets are matched by name, not duplicated.
+            self.assertEqual(new['db_bucket'], self.bucket.id)
+            self.assertEqual(new['db_date_created'], created)
+            self.assertEqual(new['db_owner'], old['db_owner'] + link_offset)
+            self.assertEqual(new['db_last_admin'], old['db_last_admin'] + comment_offset)
+            self.assertEqual(new['db_last_public'], old['db_last_public'] + comment_offset)
+            dates = set(JobCommentDB.objects.filter(db_link__db_job_id=job_id + job_offset)
+                        .values_list('db_date_created', flat=True))
+            self.assertEqual(dates, {created})
+        self.assertEqual(BucketDB.objects.filter(db_key__iexact='Tests').count(), 1)
+
+
+LEGACY_DUMP = """BUCKET|LEG|7|Imported requests
+JOB|1|LEG|NEW|1600000000|1600604800||First request
+COMMENT|1|CREATE|Nobody|1600000000|Please help.%rThanks.
+HANDLER|1|TestAccount2
+COMMENT|1|COMMENT|TestAccount2|1600000100|Staff only.
+JOB|2|LEG|APPROVED|1600001000|1600605800|1600002000|Second request
+COMMENT|2|CREATE|Nobody|1600001000|Another one.
+COMMENT|2|APPROVE|TestAccount2|1600002000|Done.
+JOB|3|{bucket}|DENIED|1600003000|1600607800|1600004000|Third request
+COMMENT|3|CREATE|Nobody|1600003000|Last one.
+"""
+
+
+class TestLegacyImport(JobTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, 'jobs.dump')
+
+    def tearDown(self):
+        self.folder.cleanup()
+        super().tearDown()
+
+    def dump(self, bucket):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(LEGACY_DUMP.format(bucket=bucket))
+
+    def importer(self):
+        return legacy.LegacyImporter(self.path, self.account, batch_size=1)
+
+    def test_import_and_resume(self):
+        offset = JobDB.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        # Job 3's bucket doesn't exist, so the first run stops after committing jobs 1 and 2.
+        self.dump('MISSING')
+        with self.assertRaises(ValueError):
+            self.importer().run()
+        self.assertEqual(set(JobDB.objects.values_list('id', flat=True)), {offset + 1, offset + 2})
+
+        self.dump('LEG')
+        counts = self.importer().run()
+        self.assertEqual(counts, {'buckets': 1, 'jobs': 3, 'links': 5, 'comments': 5})
+        first = JobDB.objects.filter(id=offset + 1).values('db_status', 'db_date_created', 'db_comment_count',
+                                                            'db_handler_names', 'db_last_public').get()
+        self.assertEqual(first['db_status'], 0)
+        self.assertEqual(first['db_date_created'], datetime.datetime.fromtimestamp(1600000000, datetime.timezone.utc))
+        self.assertEqual(first['db_comment_count'], 2)
+        self.assertEqual(first['db_handler_names'], 'TestAccount2')
+        # Names are matched to accounts here; unknown ones go to the importing account.
+        self.assertEqual(dict(JobLinkDB.objects.filter(db_job_id=offset + 1).values_list('db_account', 'db_link_type')),
+                         {self.account.id: 3, self.account2.id: 2})
+        # The staff comment is private, so the public pointer stays on the opening comment.
+        self.assertEqual(JobCommentDB.objects.get(id=first['db_last_public']).db_text, "Please help.\nThanks.")
+        self.assertEqual(JobDB.objects.get(id=offset + 3).db_status, 2)
+
+        with self.assertRaises(ValueError):
+            self.importer()
+
+
+class TestQueryBudgets(JobTestCase):
+
+    def test_job_budgets(self):
+        ids = benchmark.generate({'buckets': 3, 'jobs': 300, 'comments': 1500, 'accounts': 10})
+        bucket = BucketDB.objects.get(id=ids['buckets'][0])
+        job = JobDB.objects.filter(db_bucket=bucket).order_by('-db_comment_count', 'id').first()
+        profiling.assert_job_budgets(self.account, bucket, job)
@@ -0,0 +1,249 @@
+"""
+Streaming JSONL export and import of the whole job database.
+
+Each line is one JSON record with a 'type' of bucket, job, link, comment or archive. Buckets come
+first, then jobs in chunks: each chunk's jobs followed by their links and comments. Archived jobs come
+last. Rows are read with iterator(chunk_size=...) and written as they're read, so an export holds one
+chunk in memory at a time. Paths ending in .gz are gzip-compressed.
+
+Import keeps memory flat too: incoming job, link and comment ids are shifted past the highest
+existing id instead of looked up in a growing map, so every reference can be rewritten on the fly.
+Each chunk is written with bulk_create in its own transaction, so a chunk's jobs can point at their
+own links and comments. Buckets are matched by name and accounts and characters by key. The search
+index is not exported; rebuild it with +jbucket/reindex after an import.
+"""
+import base64
+import datetime
+import gzip
+import json
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from evennia.accounts.models import AccountDB
+from evennia.objects.models import ObjectDB
+from athanor.jobs.models import BucketDB, JobDB, JobLinkDB, JobCommentDB, JobArchiveDB
+
+BUCKET_FIELDS = ('id', 'db_key', 'db_typeclass_path', 'db_description', 'db_due', 'db_lock_storage')
+JOB_FIELDS = ('id', 'db_key', 'db_typeclass_path', 'db_bucket', 'db_date_created', 'db_date_due', 'db_date_closed', 'db_status',
+              'db_date_public_update', 'db_date_admin_update', 'db_owner', 'db_owner_name', 'db_handler_names',
+              'db_helper_names', 'db_comment_count', 'db_last_public', 'db_last_public_poster', 'db_last_admin',
+              'db_last_admin_poster')
+LINK_FIELDS = ('id', 'db_job', 'db_account__db_key', 'db_character__db_key', 'db_link_type', 'db_date_checked')
+COMMENT_FIELDS = ('id', 'db_link', 'db_date_created', 'db_text', 'db_is_private', 'db_comment_mode')
+ARCHIVE_FIELDS = ('id', 'db_bucket', 'db_bucket_name', 'db_title', 'db_status', 'db_owner__db_key', 'db_owner_name',
+                  'db_handler_names', 'db_helper_names', 'db_comment_count', 'db_date_created', 'db_date_due',
+                  'db_date_closed', 'db_date_archived', 'db_transcript')
+
+_DATE_FIELDS = {'db_date_created', 'db_date_due', 'db_date_closed', 'db_date_public_update', 'db_date_admin_update',
+                'db_date_checked', 'db_date_archived'}
+
+
+def open_stream(path, mode='r'):
+    if str(path).endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def create_dated(model, rows, batch_size=None):
+    """
+    bulk_create that keeps the rows' own db_date_created. auto_now_add stamps every new row with the
+    current time, so the dates are put back with one bulk_update. Call inside a transaction, with
+    ids already set on the rows.
+    """
+    dates = [row.db_date_created for row in rows]
+    model.objects.bulk_create(rows, batch_size=batch_size)
+    for row, date in zip(rows, dates):
+        row.db_date_created = date
+    model.objects.bulk_update(rows, ['db_date_created'], batch_size=batch_size)
+
+
+def reset_sequences(models=(JobDB, JobLinkDB, JobCommentDB)):
+    # Explicit ids leave PostgreSQL sequences behind; move them past the imported rows.
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), list(models)):
+            cursor.execute(sql)
+
+
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, (bytes, memoryview)):
+        return base64.b64encode(bytes(value)).decode('ascii')
+    raise TypeError(f"Can't export {type(value)}")
+
+
+def export(stream, chunk_size=2000):
+    """
+    Writes every bucket, job, link, comment and archived job to stream as JSONL.
+
+    Returns:
+        dict of record type: count
+    """
+    counts = {'bucket': 0, 'job': 0, 'link': 0, 'comment': 0, 'archive': 0}
+
+    def write(kind, queryset, fields):
+        for row in queryset.values(*fields).iterator(chunk_size=chunk_size):
+            row['type'] = kind
+            stream.write(json.dumps(row, default=_encode))
+            stream.write('\n')
+            counts[kind] += 1
+
+    write('bucket', BucketDB.objects.order_by('id'), BUCKET_FIELDS)
+    last = 0
+    while True:
+        job_ids = list(JobDB.objects.filter(id__gt=last).order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not job_ids:
+            break
+        first, last = job_ids[0], job_ids[-1]
+        write('job', JobDB.objects.filter(id__gte=first, id__lte=last).order_by('id'), JOB_FIELDS)
+        write('link', JobLinkDB.objects.filter(db_job_id__gte=first, db_job_id__lte=last).order_by('id'),
+              LINK_FIELDS)
+        write('comment', JobCommentDB.objects.filter(db_link__db_job_id__gte=first, db_link__db_job_id__lte=last)
+              .order_by('id'), COMMENT_FIELDS)
+    write('archive', JobArchiveDB.objects.order_by('id'), ARCHIVE_FIELDS)
+    return counts
+
+
+class _Importer:
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.pending = {model: list() for model in (JobDB, JobLinkDB, JobCommentDB, JobArchiveDB)}
+        self.last_kind = None
+        self.buckets = dict()
+        self.accounts = dict(AccountDB.objects.values_list('db_key', 'id'))
+        self.characters = dict()
+        self.job_offset = JobDB.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        last_archive = JobArchiveDB.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        self.job_offset = max(self.job_offset, last_archive)
+        self.link_offset = JobLinkDB.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        self.comment_offset = JobCommentDB.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        self.counts = dict()
+
+    def shift(self, value, offset):
+        return None if value is None else value + offset
+
+    def character(self, name):
+        if name is None:
+            return None
+        if name not in self.characters:
+            self.characters[name] = ObjectDB.objects.filter(db_key=name).values_list('id', flat=True).first()
+        return self.characters[name]
+
+    def add(self, model, obj):
+        self.pending[model].append(obj)
+
+    def flush(self):
+        """
+        Writes one chunk in its own transaction, parents before children.
+        """
+        with transaction.atomic():
+            for model, rows in self.pending.items():
+                if not rows:
+                    continue
+                if model in (JobDB, JobCommentDB):
+                    create_dated(model, rows, batch_size=self.batch_size)
+                else:
+                    model.objects.bulk_create(rows, batch_size=self.batch_size)
+        self.pending = {model: list() for model in self.pending}
+
+    def bucket(self, row):
+        existing = BucketDB.objects.filter(db_key__iexact=row['db_key']).first()
+        if not existing:
+            existing = BucketDB(db_key=row['db_key'], db_typeclass_path=row['db_typeclass_path'],
+                                db_description=row['db_description'],
+                                db_due=datetime.timedelta(seconds=row['db_due']),
+                                db_lock_storage=row['db_lock_storage'])
+            existing.save()
+        self.buckets[row['id']] = existing.id
+
+    def job(self, row):
+        # Owner and last-comment ids point at links and comments later in the same chunk. Django's
+        # foreign keys are deferred, so they're only checked when the chunk's transaction commits.
+        self.add(JobDB, JobDB(
+            id=row['id'] + self.job_offset, db_key=row['db_key'], db_typeclass_path=row['db_typeclass_path'],
+            db_bucket_id=self.buckets[row['db_bucket']],
+            db_date_created=row['db_date_created'], db_date_due=row['db_date_due'],
+            db_date_closed=row['db_date_closed'], db_status=row['db_status'],
+            db_date_public_update=row['db_date_public_update'], db_date_admin_update=row['db_date_admin_update'],
+            db_owner_id=self.shift(row['db_owner'], self.link_offset), db_owner_name=row['db_owner_name'],
+            db_handler_names=row['db_handler_names'], db_helper_names=row['db_helper_names'],
+            db_comment_count=row['db_comment_count'],
+            db_last_public_id=self.shift(row['db_last_public'], self.comment_offset),
+            db_last_public_poster=row['db_last_public_poster'],
+            db_last_admin_id=self.shift(row['db_last_admin'], self.comment_offset),
+            db_last_admin_poster=row['db_last_admin_poster']))
+
+    def link(self, row, fallback):
+        self.add(JobLinkDB, JobLinkDB(
+            id=row['id'] + self.link_offset, db_job_id=row['db_job'] + self.job_offset,
+            db_account_id=self.accounts.get(row['db_account__db_key'], fallback.id),
+            db_character_id=self.character(row['db_character__db_key']),
+            db_link_type=row['db_link_type'], db_date_checked=row['db_date_checked']))
+
+    def comment(self, row):
+        self.add(JobCommentDB, JobCommentDB(
+            id=row['id'] + self.comment_offset, db_link_id=row['db_link'] + self.link_offset,
+            db_date_created=row['db_date_created'], db_text=row['db_text'], db_is_private=row['db_is_private'],
+            db_comment_mode=row['db_comment_mode']))
+
+    def archive(self, row):
+        self.add(JobArchiveDB, JobArchiveDB(
+            id=row['id'] + self.job_offset, db_bucket_id=self.buckets.get(row['db_bucket']),
+            db_bucket_name=row['db_bucket_name'], db_title=row['db_title'], db_status=row['db_status'],
+            db_owner_id=self.accounts.get(row['db_owner__db_key']), db_owner_name=row['db_owner_name'],
+            db_handler_names=row['db_handler_names'], db_helper_names=row['db_helper_names'],
+            db_comment_count=row['db_comment_count'], db_date_created=row['db_date_created'],
+            db_date_due=row['db_date_due'], db_date_closed=row['db_date_closed'],
+            db_date_archived=row['db_date_archived'], db_transcript=base64.b64decode(row['db_transcript'])))
+
+    def run(self, stream, fallback):
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            row = json.loads(line)
+            kind = row.pop('type')
+            for field in _DATE_FIELDS.intersection(row):
+                if row[field]:
+                    row[field] = datetime.datetime.fromisoformat(row[field])
+            # A job after anything but another job starts a new chunk; so does the first archive.
+            if (kind == 'job' and self.last_kind not in (None, 'job')) or \
+                    (kind == 'archive' and self.last_kind != 'archive') or \
+                    len(self.pending[JobArchiveDB]) >= self.batch_size:
+                self.flush()
+            self.last_kind = kind
+            if kind == 'bucket':
+                self.bucket(row)
+            elif kind == 'job':
+                self.job(row)
+            elif kind == 'link':
+                self.link(row, fallback)
+            elif kind == 'comment':
+                self.comment(row)
+            elif kind == 'archive':
+                self.archive(row)
+            else:
+                raise ValueError(f"Unknown record type: {kind}")
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+        self.flush()
+        reset_sequences()
+
+
+def load(stream, fallback_account, batch_size=1000):
+    """
+    Imports a stream written by export(), one transaction per chunk of jobs. If it fails part-way,
+    the chunks before the failure stay imported.
+
+    Args:
+        stream: Text stream of JSONL records.
+        fallback_account (AccountDB): Owner for links whose account doesn't exist on this server.
+        batch_size (int): Rows per bulk_create statement.
+
+    Returns:
+        dict of record type: count
+    """
+    importer = _Importer(batch_size)
+    importer.run(stream, fallback_account)
+    return importer.counts